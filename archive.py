@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+archive.py -- Conference Central hot/cold partitioning: flags finished
+    conferences and their sessions as archived
+
+Conference listings (queryConferences, getConferencesByTopic), the
+announcement and warmup filter on archived == False once
+settings.FILTER_ARCHIVED is set, so their index scans cover only current
+conferences however many past ones pile up.
+A daily cron archives conferences whose endDate has passed, a batch at
+a time, together with their sessions in the same entity group.
+
+$Id$
+
+"""
+
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from facets import conferenceFacets
+from facets import enqueueFacetUpdate
+from models import Conference
+from models import Session
+from worker import enqueueAnnouncementUpdate
+from worker import isNearlySoldOut
+
+ARCHIVE_BATCH_SIZE = 50
+
+
+@ndb.transactional()
+def _archiveConference(c_key):
+    """Archive one conference & its sessions; return True if it changed."""
+    conf = c_key.get()
+    if conf is None or conf.archived:
+        return False
+    old_facets = conferenceFacets(conf)
+    sessions = Session.query(ancestor=c_key).fetch()
+    conf.archived = True
+    for session in sessions:
+        session.archived = True
+    ndb.put_multi([conf] + sessions)
+    # drop it from the facet counts and the nearly sold out set
+    enqueueFacetUpdate(old_facets, conferenceFacets(conf))
+    if isNearlySoldOut(conf):
+        enqueueAnnouncementUpdate(c_key)
+    return True
+
+
+def archiveFinishedConferences(today=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive one batch of conferences that ended before today.
+
+    Returns (number archived, True if there may be more to archive).
+    Archived conferences leave the query, so each batch simply runs it
+    again. The query is eventually consistent and may return conferences
+    that are already archived, so a batch that archived nothing reports
+    no more: otherwise stale results could chain tasks forever. The next
+    daily run picks up anything left.
+    """
+    today = today or date.today()
+    keys = Conference.query(Conference.archived == False,
+                            Conference.endDate < today).fetch(
+        batch_size, keys_only=True)
+    archived = sum(1 for c_key in keys if _archiveConference(c_key))
+    return archived, archived > 0 and len(keys) == batch_size
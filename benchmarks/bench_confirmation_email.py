@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+bench_confirmation_email.py -- bulk conference onboarding against the
+    confirmation-email pull queue and the local mail stub
+
+A handful of organizers create many conferences through the
+ConferenceApi; the cron consumer then drains the queue. Reports queued
+tasks, emails sent, batches, RPCs and time for the drain, optionally
+with a fraction of mail sends failing.
+
+The run also checks that every queued task was either emailed about,
+dropped or left for a retry, and that tasks whose emails always fail
+are retried, then dropped once they reach MAX_EMAIL_RETRIES; it exits
+with an error if not.
+
+Usage:
+    python benchmarks/bench_confirmation_email.py [--conferences N] \\
+        [--organizers N] [--fail-rate F]
+
+$Id$
+
+"""
+
+import argparse
+import json
+import random
+import time
+
+from sdk import activateTestbed
+from sdk import actAs
+from sdk import liftRateLimits
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+import confirmation
+from conference import ConferenceApi
+from instrumentation import startRecording
+from instrumentation import stopRecording
+from instrumentation import summarize
+from models import ConferenceForm
+
+
+def _failingSendMail(rng, rate, send_mail):
+    def sendMail(*args, **kwargs):
+        if rng.random() < rate:
+            raise mail.Error('injected failure')
+        return send_mail(*args, **kwargs)
+    return sendMail
+
+
+def _check(condition, message, *args):
+    if not condition:
+        raise SystemExit('check failed: ' + message % args)
+
+
+def _createConferences(api, rng, count, organizers):
+    for i in range(count):
+        actAs('organizer%d@example.com' % rng.randrange(organizers))
+        api.createConference(ConferenceForm(
+            name='Conference %d' % i, city='London',
+            topics=['Cloud'], maxAttendees=100,
+            startDate='2016-05-01', endDate='2016-05-02'))
+
+
+def checkRetries(api, rng, bed, count=3):
+    """Fail every email of count new conferences; check the tasks are
+    retried until MAX_EMAIL_RETRIES, then dropped. Returns the number of
+    times they were leased."""
+    queue = taskqueue.Queue(confirmation.CONFIRMATION_QUEUE)
+    queue.purge()
+    _createConferences(api, rng, count, 1)
+    mails = len(bed.get_stub('mail').get_sent_messages())
+    leases, dropped = 0, 0
+    while True:
+        tasks = queue.lease_tasks(confirmation.LEASE_SECONDS,
+                                  confirmation.LEASE_BATCH_SIZE)
+        if not tasks:
+            break
+        leases += 1
+        _check(leases <= confirmation.MAX_EMAIL_RETRIES + 1,
+               'tasks still retried after %d leases', leases)
+        stats = {'sent': 0, 'conferences': 0, 'failed': 0, 'dropped': 0}
+        retry = confirmation.processBatch(
+            queue, tasks, stats, _failingSendMail(rng, 1.0, mail.send_mail))
+        expected = set(task.name for task in tasks
+                       if task.retry_count < confirmation.MAX_EMAIL_RETRIES)
+        _check(set(task.name for task in retry) == expected,
+               'wrong tasks kept for a retry at lease %d', leases)
+        _check(stats['failed'] == len(retry), 'failed count %d, expected %d',
+               stats['failed'], len(retry))
+        dropped += stats['dropped']
+        # release the leases now instead of waiting for them to expire
+        for task in retry:
+            queue.modify_task_lease(task, 0)
+    _check(leases >= confirmation.MAX_EMAIL_RETRIES,
+           'tasks dropped after only %d leases', leases)
+    _check(dropped == count, '%d of %d tasks dropped', dropped, count)
+    _check(len(bed.get_stub('mail').get_sent_messages()) == mails,
+           'failed sends reached the mail stub')
+    return leases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--conferences', type=int, default=500)
+    parser.add_argument('--organizers', type=int, default=20)
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='fraction of mail sends that raise')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bed = activateTestbed()
+    liftRateLimits()
+    try:
+        rng = random.Random(args.seed)
+        api = ConferenceApi()
+        _createConferences(api, rng, args.conferences, args.organizers)
+        taskqueue_stub = bed.get_stub('taskqueue')
+        queued = len(taskqueue_stub.get_filtered_tasks(
+            queue_names=[confirmation.CONFIRMATION_QUEUE]))
+
+        send_mail = mail.send_mail
+        if args.fail_rate:
+            send_mail = _failingSendMail(rng, args.fail_rate, send_mail)
+        startRecording()
+        start = time.time()
+        stats = confirmation.sendConfirmationEmails(send_mail=send_mail)
+        elapsed = time.time() - start
+        _, rpcs = summarize(stopRecording())
+
+        mails = len(bed.get_stub('mail').get_sent_messages())
+        left = len(taskqueue_stub.get_filtered_tasks(
+            queue_names=[confirmation.CONFIRMATION_QUEUE]))
+        _check(queued == args.conferences, '%d tasks queued for %d '
+               'conferences', queued, args.conferences)
+        _check(mails == stats['sent'], '%d mails in the stub, %d sent',
+               mails, stats['sent'])
+        _check(stats['conferences'] + stats['dropped'] + left == queued,
+               'tasks unaccounted for: %r, %d left of %d', stats, left,
+               queued)
+        if not args.fail_rate:
+            _check(left == 0 and not stats['failed'],
+                   '%d tasks left after a clean drain', left)
+
+        results = {
+            'conferences': args.conferences,
+            'queuedTasks': queued,
+            'drain': stats,
+            'seconds': round(elapsed, 4),
+            'rpcs': rpcs,
+            'mailsInStub': mails,
+            'leftInQueue': left,
+            'leasesBeforeDrop': checkRetries(api, rng, bed),
+        }
+    finally:
+        bed.deactivate()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+bench_encoding.py -- stored size and deserialization cost of Session and
+    Profile entities, in the old and the compact encoding
+
+Old-format entities are built with stand-in models declaring the old
+property types, serialized to protocol buffers, and decoded both by the
+stand-ins and by the current models (the transparent legacy read path).
+Profile decoding includes turning the membership lists into keys, which
+the old format needed ndb.Key(urlsafe=...) for.
+
+Usage: python benchmarks/bench_encoding.py [rows]
+
+$Id$
+
+"""
+
+import json
+import sys
+import timeit
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import Speaker
+
+
+class LegacySession(ndb.Model):
+    """Session, as stored before the compact encoding."""
+    name = ndb.StringProperty(required=True)
+    highlights = ndb.StringProperty(repeated=True)
+    speakers = ndb.KeyProperty(kind=Speaker, repeated=True)
+    duration = ndb.TimeProperty()
+    typeOfSession = ndb.StringProperty(default='NOT_SPECIFIED')
+    date = ndb.DateProperty()
+    startTime = ndb.TimeProperty()
+    modified = ndb.DateTimeProperty()
+
+
+class LegacyProfile(ndb.Model):
+    """Profile, as stored before the compact encoding."""
+    displayName = ndb.StringProperty()
+    mainEmail = ndb.StringProperty()
+    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    wishListSessionKeys = ndb.StringProperty(repeated=True)
+    wishListIntervals = ndb.JsonProperty()
+
+
+def makeRows(n):
+    """Return (legacy, compact) lists of equivalent sessions & profiles."""
+    modified = datetime(2015, 5, 1, 12, 0)
+    sessions, profiles = ([], []), ([], [])
+    for i in range(n):
+        c_key = ndb.Key(Conference, i + 1,
+                        parent=ndb.Key(Profile, 'organizer@example.com'))
+        s_key = ndb.Key(Session, i + 1, parent=c_key)
+        values = dict(name='Session %d' % i, highlights=['intro', 'demo'],
+                      speakers=[ndb.Key(Speaker, 'speaker %d' % (i % 50))],
+                      duration=time(1, 30), typeOfSession='Workshop',
+                      date=date(2015, 6, 1), startTime=time(9, 30),
+                      modified=modified)
+        sessions[0].append(LegacySession(key=s_key, **values))
+        sessions[1].append(Session(key=s_key, **values))
+
+        p_key = ndb.Key(Profile, 'user%d@example.com' % i)
+        attending = [ndb.Key(Conference, j + 1, parent=c_key.parent())
+                     for j in range(i % 7)]
+        wished = [ndb.Key(Session, j + 1, parent=c_key) for j in range(i % 5)]
+        values = dict(displayName='User %d' % i,
+                      mainEmail='user%d@example.com' % i,
+                      teeShirtSize='M_W')
+        profiles[0].append(LegacyProfile(
+            key=p_key, conferenceKeysToAttend=[k.urlsafe() for k in attending],
+            wishListSessionKeys=[k.urlsafe() for k in wished], **values))
+        profiles[1].append(Profile(
+            key=p_key, conferenceKeysToAttend=attending,
+            wishListSessionKeys=wished, **values))
+    return sessions, profiles
+
+
+def encode(entities):
+    return [entity._to_pb().Encode() for entity in entities]
+
+
+def decoder(model, key_lists=False):
+    """Return a function decoding one serialized entity with model."""
+    def decode(data):
+        entity = model._from_pb(entity_pb.EntityProto(data))
+        if key_lists:
+            keys = entity.conferenceKeysToAttend + entity.wishListSessionKeys
+            if keys and not isinstance(keys[0], ndb.Key):
+                keys = [ndb.Key(urlsafe=k) for k in keys]
+        return entity
+    return decode
+
+
+def perRow(func, rows, repeat=5):
+    """Best-of-repeat cost of func over rows, in microseconds per row."""
+    timer = timeit.Timer(lambda: [func(row) for row in rows])
+    return min(timer.repeat(repeat=repeat, number=1)) / len(rows) * 1e6
+
+
+def sameValues(decoded, expected, names):
+    return all(getattr(a, name) == getattr(b, name)
+               for a, b in zip(decoded, expected) for name in names)
+
+
+def main(n):
+    sessions, profiles = makeRows(n)
+    results = {}
+    for name, (legacy, compact), legacy_model, model, key_lists, names in [
+            ('session', sessions, LegacySession, Session, False,
+             ('duration', 'startTime', 'typeOfSession')),
+            ('profile', profiles, LegacyProfile, Profile, True,
+             ('teeShirtSize',))]:
+        old, new = encode(legacy), encode(compact)
+        legacy_as_new = [decoder(model)(data) for data in old]
+        results[name] = {
+            'bytesOld': round(sum(map(len, old)) / float(n), 1),
+            'bytesCompact': round(sum(map(len, new)) / float(n), 1),
+            'decodeOldUs': round(perRow(
+                decoder(legacy_model, key_lists), old), 2),
+            'decodeCompactUs': round(perRow(
+                decoder(model, key_lists), new), 2),
+            'decodeOldWithCompactModelUs': round(perRow(
+                decoder(model, key_lists), old), 2),
+            'legacyReadsMatch': sameValues(legacy_as_new, compact, names),
+        }
+    results['profile']['legacyReadsMatch'] &= all(
+        a.conferenceKeysToAttend == b.conferenceKeysToAttend
+        for a, b in zip([decoder(Profile)(d) for d in encode(profiles[0])],
+                        profiles[1]))
+    print(json.dumps({'rows': n, 'results': results}, indent=2,
+                     sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
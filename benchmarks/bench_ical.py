@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+bench_ical.py -- cost of rendering conference agenda and wish-list
+    iCalendar feeds, and of the cached polls that follow
+
+Usage: python benchmarks/bench_ical.py [--polls N]
+
+$Id$
+
+"""
+
+import argparse
+import json
+import time
+from collections import Counter
+
+from sdk import activateTestbed
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import datagen
+import ical
+from models import Profile
+from instrumentation import startRecording
+from instrumentation import stopRecording
+from instrumentation import summarize
+
+
+def measure(fetch, feeds, polls):
+    """Render each feed once, then poll it; return per-call averages."""
+    results = {}
+    for phase, repeat in (('render', 1), ('poll', polls)):
+        seconds, rpcs, size = 0.0, Counter(), 0
+        for args in feeds:
+            for _ in range(repeat):
+                ndb.get_context().clear_cache()
+                startRecording()
+                start = time.time()
+                size = len(fetch(*args))
+                seconds += time.time() - start
+                rpcs.update(summarize(stopRecording())[1])
+        calls = float(len(feeds) * repeat)
+        results[phase] = {
+            'ms': round(seconds / calls * 1000, 3),
+            'rpcs': dict((k, round(v / calls, 2)) for k, v in rpcs.items()),
+        }
+    results['lastFeedBytes'] = size
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--feeds', type=int, default=20)
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bed = activateTestbed()
+    try:
+        data = datagen.generate(seed=args.seed)
+        memcache.flush_all()
+        conference_feeds = [(c_key.urlsafe(),)
+                            for c_key in data.conference_keys[:args.feeds]]
+        profiles = ndb.get_multi([ndb.Key(Profile, email)
+                                  for email in data.emails[:args.feeds]])
+        for prof in profiles:
+            prof.feedToken = ical.newFeedToken()
+        ndb.put_multi(profiles)
+        wishlist_feeds = [(prof.feedToken,) for prof in profiles]
+        results = {
+            'conference': measure(ical.conferenceFeed, conference_feeds,
+                                  args.polls),
+            'wishlist': measure(ical.wishlistFeed, wishlist_feeds,
+                                args.polls),
+        }
+    finally:
+        bed.deactivate()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+bench_rate_limit.py -- one client hammering registerForConference and
+    unregisterFromConference under the per-user rate limit
+
+Reports how many calls went through and how many were rejected, with
+the mean wall time and RPCs of each; rejected calls should make no
+datastore RPCs.
+
+Usage: python benchmarks/bench_rate_limit.py [calls]
+
+$Id$
+
+"""
+
+import json
+import sys
+import time
+
+from sdk import activateTestbed
+from sdk import actAs
+from sdk import setupSdk
+setupSdk()
+
+from conference import CONF_GET_REQUEST
+from conference import ConferenceApi
+from instrumentation import startRecording
+from instrumentation import stopRecording
+from instrumentation import summarize
+from models import ConferenceForm
+from ratelimit import RateLimitException
+
+
+def _mean(outcome):
+    count = outcome['calls'] or 1
+    outcome['wallMs'] = round(outcome['wallMs'] / count, 3)
+    outcome['rpcs'] = dict((name, round(total / float(count), 2))
+                           for name, total in outcome['rpcs'].items())
+
+
+def main(calls):
+    bed = activateTestbed()
+    try:
+        api = ConferenceApi()
+        actAs('organizer@example.com')
+        conf = api.createConference(ConferenceForm(
+            name='Flash sale', city='London', topics=['Cloud'],
+            maxAttendees=1000, startDate='2016-05-01', endDate='2016-05-02'))
+        request = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=conf.websafeKey)
+
+        actAs('hammer@example.com')
+        outcomes = dict((name, {'calls': 0, 'wallMs': 0.0, 'rpcs': {}})
+                        for name in ('accepted', 'rejected'))
+        for i in range(calls):
+            method = api.unregisterFromConference if i % 2 else \
+                api.registerForConference
+            startRecording()
+            start = time.time()
+            try:
+                method(request)
+                outcome = outcomes['accepted']
+            except RateLimitException:
+                outcome = outcomes['rejected']
+            outcome['wallMs'] += (time.time() - start) * 1000
+            outcome['calls'] += 1
+            for name, count in summarize(stopRecording())[1].items():
+                outcome['rpcs'][name] = outcome['rpcs'].get(name, 0) + count
+        for outcome in outcomes.values():
+            _mean(outcome)
+    finally:
+        bed.deactivate()
+    print(json.dumps(outcomes, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
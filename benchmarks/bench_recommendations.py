@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+bench_recommendations.py -- the recommendations batch job, and serving
+    recommendations from its output versus scanning every profile's
+    wish-list at request time
+
+Needs numpy in the local Python, as the job does on App Engine.
+
+Usage: python benchmarks/bench_recommendations.py [--profiles N] \\
+    [--conferences N] [--users N]
+
+$Id$
+
+"""
+
+import argparse
+import json
+import time
+from collections import Counter
+
+from sdk import activateTestbed
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.ext import ndb
+
+import datagen
+from instrumentation import startRecording
+from instrumentation import stopRecording
+from instrumentation import summarize
+from models import Profile
+from recommendations import buildRecommendations
+from recommendations import recommendSessions
+
+
+def scanProfiles(wished_keys, limit):
+    """Recommend at request time: count what co-wishers also wish for."""
+    wished = set(wished_keys)
+    counts = Counter()
+    for prof in Profile.query():
+        keys = set(prof.wishListSessionKeys)
+        if keys & wished:
+            counts.update(keys - wished)
+    return [s_key for s_key, _ in counts.most_common(limit)]
+
+
+def timed(func, *args):
+    """Return (result, seconds, RPC summary) of one call."""
+    ndb.get_context().clear_cache()
+    startRecording()
+    start = time.time()
+    result = func(*args)
+    elapsed = time.time() - start
+    return result, elapsed, summarize(stopRecording())[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--profiles', type=int, default=2000)
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50,
+                        help='wish-lists to recommend for')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bed = activateTestbed()
+    try:
+        data = datagen.generate(profiles=args.profiles,
+                                conferences=args.conferences, seed=args.seed)
+        stats, build_seconds, build_rpcs = timed(buildRecommendations)
+
+        wish_lists = [prof.wishListSessionKeys for prof in ndb.get_multi(
+            [ndb.Key(Profile, email) for email in data.emails[:args.users]])]
+        serving = {}
+        for name, func in (('precomputed', recommendSessions),
+                           ('scanProfiles', scanProfiles)):
+            seconds, rpcs = 0.0, Counter()
+            for wished in wish_lists:
+                _, elapsed, summary = timed(func, wished, 10)
+                seconds += elapsed
+                rpcs.update(summary)
+            serving[name] = {
+                'msPerCall': round(seconds / len(wish_lists) * 1000, 3),
+                'rpcsPerCall': dict((k, round(v / float(len(wish_lists)), 2))
+                                    for k, v in rpcs.items()),
+            }
+        results = {
+            'profiles': args.profiles,
+            'build': {'seconds': round(build_seconds, 3),
+                      'rpcs': build_rpcs, 'stats': stats},
+            'serving': serving,
+        }
+    finally:
+        bed.deactivate()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
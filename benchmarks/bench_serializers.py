@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""
+bench_serializers.py -- per-row cost of copying entities to forms, with
+    the reflective all_fields() loops versus the precompiled serializers
+
+Usage: python benchmarks/bench_serializers.py [rows]
+
+Speakers are left out of the session rows so only CPU work is measured.
+
+$Id$
+
+"""
+
+import json
+import sys
+import timeit
+from datetime import date
+from datetime import time
+
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import SessionType
+from models import TeeShirtSize
+
+from serializers import CONFERENCE_SERIALIZER
+from serializers import PROFILE_SERIALIZER
+from serializers import SESSION_SERIALIZER
+
+
+# - - - reflective copies, as they were before serializers.py - - - - -
+
+def reflectiveConferenceToForm(conf, displayName):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    if displayName:
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveSessionToForm(session):
+    session_form = SessionForm()
+    for field in session_form.all_fields():
+        if hasattr(session, field.name):
+            if field.name in ('date', 'startTime', 'duration'):
+                setattr(session_form, field.name,
+                        str(getattr(session, field.name)))
+            elif field.name == 'typeOfSession':
+                setattr(session_form, field.name,
+                        getattr(SessionType, getattr(session, field.name)))
+            elif field.name == 'speakers':
+                setattr(session_form, field.name,
+                        [str(s.get().name) for s in session.speakers])
+            else:
+                setattr(session_form, field.name,
+                        getattr(session, field.name))
+        elif field.name == "websafeKey":
+            setattr(session_form, field.name, session.key.urlsafe())
+        elif field.name == "websafeConferenceKey":
+            setattr(session_form, field.name,
+                    session.key.parent().urlsafe())
+    session_form.check_initialized()
+    return session_form
+
+
+def reflectiveProfileToForm(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name,
+                        getattr(TeeShirtSize, getattr(prof, field.name)))
+            elif field.name in ('conferenceKeysToAttend',
+                                'wishListSessionKeys'):
+                setattr(pf, field.name,
+                        [key.urlsafe() for key in getattr(prof, field.name)])
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+# - - - data - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def makeRows(n):
+    p_key = ndb.Key(Profile, 'organizer@example.com')
+    confs, sessions, profiles = [], [], []
+    for i in range(n):
+        c_key = ndb.Key(Conference, i + 1, parent=p_key)
+        confs.append(Conference(
+            key=c_key, name='Conference %d' % i,
+            description='A conference about things ' * 4,
+            organizerUserId='organizer@example.com',
+            topics=['Web', 'Python', 'Cloud'], city='London',
+            startDate=date(2015, 6, 1), month=6, endDate=date(2015, 6, 3),
+            maxAttendees=500, seatsAvailable=120))
+        sessions.append(Session(
+            key=ndb.Key(Session, i + 1, parent=c_key),
+            name='Session %d' % i, highlights=['intro', 'demo'],
+            duration=time(1, 30), typeOfSession='Lecture',
+            date=date(2015, 6, 1), startTime=time(9, 0)))
+        profiles.append(Profile(
+            key=ndb.Key(Profile, 'user%d@example.com' % i),
+            displayName='User %d' % i, mainEmail='user%d@example.com' % i,
+            teeShirtSize='M_W',
+            conferenceKeysToAttend=[c_key],
+            wishListSessionKeys=[]))
+    return confs, sessions, profiles
+
+
+def perRow(func, rows, repeat=5):
+    """Best-of-repeat cost of func over rows, in microseconds per row."""
+    timer = timeit.Timer(lambda: [func(row) for row in rows])
+    return min(timer.repeat(repeat=repeat, number=1)) / len(rows) * 1e6
+
+
+def main(n):
+    confs, sessions, profiles = makeRows(n)
+    cases = [
+        ('conference', confs,
+         lambda c: reflectiveConferenceToForm(c, 'Organizer'),
+         lambda c: CONFERENCE_SERIALIZER.toForm(c, 'Organizer')),
+        ('session', sessions, reflectiveSessionToForm,
+         lambda s: SESSION_SERIALIZER.toForm(s, {})),
+        ('profile', profiles, reflectiveProfileToForm,
+         PROFILE_SERIALIZER.toForm),
+    ]
+    results = {}
+    for name, rows, before, after in cases:
+        assert before(rows[0]) == after(rows[0]), name
+        results[name] = {'reflective_us_per_row': perRow(before, rows),
+                         'compiled_us_per_row': perRow(after, rows)}
+    print(json.dumps({'rows': n, 'results': results}, indent=2,
+                     sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
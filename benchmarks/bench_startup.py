@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+bench_startup.py -- cold import cost of the two WSGI apps
+
+Imports main (the cron & task queue app) and conference (the endpoints
+API) each in a fresh interpreter, the way a new instance loads them, and
+reports median import times and whether main pulled in endpoints.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N]
+
+$Id$
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = '''
+import json, sys, time
+sys.path.insert(0, %r)
+from sdk import setupSdk
+setupSdk()
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(json.dumps({'ms': elapsed * 1000,
+                  'endpoints': 'endpoints' in sys.modules,
+                  'modules': len(sys.modules)}))
+'''
+
+
+def importOnce(module):
+    """Import module in a fresh interpreter; return its measurements."""
+    output = subprocess.check_output(
+        [sys.executable, '-c', _CHILD % (HERE, module)])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=9)
+    args = parser.parse_args()
+
+    results = {}
+    for module in ('main', 'conference'):
+        runs = [importOnce(module) for _ in range(args.runs)]
+        results[module] = {
+            'medianMs': round(_median([r['ms'] for r in runs]), 1),
+            'modules': runs[-1]['modules'],
+            'importsEndpoints': runs[-1]['endpoints'],
+        }
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
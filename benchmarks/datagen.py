@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""
+datagen.py -- synthetic Conference Central data for benchmarks
+
+Popularity is skewed the way real traffic is: a few organizers create
+most conferences, a few cities and topics dominate, a few speakers give
+most talks, and registrations and wish-lists pile onto popular
+conferences. All choices come from a seeded random.Random, so a given
+seed and size always produce the same data set.
+
+$Id$
+
+"""
+
+import math
+import random
+from bisect import bisect_right
+from datetime import date
+from datetime import time
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import SessionType
+from models import Speaker
+from models import TeeShirtSize
+
+from wishlist import buildIndex
+
+CITIES = ['London', 'San Francisco', 'New York', 'Berlin', 'Paris', 'Tokyo',
+          'Chicago', 'Madrid', 'Sydney', 'Toronto', 'Amsterdam', 'Dublin']
+TOPICS = ['Web Technologies', 'Programming Languages', 'Cloud', 'Mobile',
+          'Data', 'Security', 'DevOps', 'Design', 'Machine Learning',
+          'Databases', 'Testing', 'Startups']
+CAPACITIES = [10, 25, 50, 100, 250, 500, 1000]
+DURATIONS = [time(0, 30), time(0, 45), time(1, 0), time(1, 30), time(3, 0)]
+SESSION_TYPES = [t.name for t in SessionType if t.name != 'NOT_SPECIFIED']
+TEE_SHIRT_SIZES = [t.name for t in TeeShirtSize]
+
+PUT_BATCH_SIZE = 500
+
+
+class Zipf(object):
+    """Pick items with probability proportional to 1 / rank ** exponent."""
+
+    def __init__(self, rng, items, exponent=1.1):
+        self.rng = rng
+        self.items = list(items)
+        total, self.cumulative = 0.0, []
+        for rank in range(1, len(self.items) + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def pick(self):
+        i = bisect_right(self.cumulative, self.rng.random() * self.total)
+        return self.items[min(i, len(self.items) - 1)]
+
+    def sample(self, k):
+        """Up to k distinct items, popular ones more likely."""
+        picked = []
+        for _ in range(k * 4):
+            item = self.pick()
+            if item not in picked:
+                picked.append(item)
+                if len(picked) == k:
+                    break
+        return picked
+
+
+class Dataset(object):
+    """Keys and names of the generated entities, most popular first."""
+
+    def __init__(self):
+        self.emails = []
+        self.conference_keys = []
+        self.session_keys = []
+        self.speaker_names = []
+        self.sessions_by_conference = {}
+
+
+def _putAll(entities):
+    for i in range(0, len(entities), PUT_BATCH_SIZE):
+        ndb.put_multi(entities[i:i + PUT_BATCH_SIZE])
+
+
+def generate(profiles=500, conferences=100, sessions_per_conference=8,
+             speakers=200, seed=1):
+    """Write a synthetic data set to the (testbed) datastore.
+
+    Returns a Dataset describing it.
+    """
+    rng = random.Random(seed)
+    data = Dataset()
+
+    # profiles
+    profile_entities = []
+    for i in range(profiles):
+        email = 'user%d@example.com' % i
+        data.emails.append(email)
+        profile_entities.append(Profile(
+            key=ndb.Key(Profile, email), displayName='User %d' % i,
+            mainEmail=email, teeShirtSize=rng.choice(TEE_SHIRT_SIZES)))
+    by_email = dict((p.mainEmail, p) for p in profile_entities)
+
+    # speakers, keyed like _createSessionObject does
+    speaker_entities = []
+    for i in range(speakers):
+        name = 'Speaker %d' % i
+        data.speaker_names.append(name)
+        speaker_entities.append(
+            Speaker(key=ndb.Key(Speaker, name.lower()), name=name))
+
+    # conferences: few organizers, cities and topics dominate
+    organizers = Zipf(rng, data.emails)
+    cities = Zipf(rng, CITIES)
+    topics = Zipf(rng, TOPICS)
+    conference_entities = []
+    for i in range(conferences):
+        organizer = organizers.pick()
+        start = date(2015, 1, 1) + timedelta(days=rng.randint(0, 700))
+        capacity = rng.choice(CAPACITIES)
+        conf = Conference(
+            key=ndb.Key(Conference, i + 1, parent=ndb.Key(Profile, organizer)),
+            name='Conference %04d' % i,
+            description='Synthetic conference number %d' % i,
+            organizerUserId=organizer,
+            topics=topics.sample(rng.randint(1, 3)),
+            city=cities.pick(),
+            startDate=start,
+            month=start.month,
+            endDate=start + timedelta(days=rng.randint(0, 3)),
+            maxAttendees=capacity,
+            seatsAvailable=capacity)
+        conference_entities.append(conf)
+        data.conference_keys.append(conf.key)
+
+    # sessions: log-normal count per conference, popular speakers
+    speaker_picker = Zipf(rng, [s.key for s in speaker_entities])
+    session_entities = []
+    session_id = 0
+    for conf in conference_entities:
+        count = max(1, int(rng.lognormvariate(
+            math.log(sessions_per_conference), 0.6)))
+        keys = []
+        days = (conf.endDate - conf.startDate).days + 1
+        for _ in range(count):
+            session_id += 1
+            session = Session(
+                key=ndb.Key(Session, session_id, parent=conf.key),
+                name='Session %d' % session_id,
+                highlights=['highlight %d' % rng.randint(0, 50)],
+                speakers=speaker_picker.sample(rng.choice([1, 1, 1, 2, 3])),
+                duration=rng.choice(DURATIONS),
+                typeOfSession=rng.choice(SESSION_TYPES),
+                date=conf.startDate + timedelta(days=rng.randrange(days)),
+                startTime=time(rng.randint(8, 17), rng.choice([0, 30])))
+            session_entities.append(session)
+            keys.append(session.key)
+        data.sessions_by_conference[conf.key] = keys
+        data.session_keys.extend(keys)
+
+    # registrations and wish-lists pile onto popular conferences
+    popular = Zipf(rng, conference_entities)
+    sessions_by_key = dict((s.key, s) for s in session_entities)
+    for email in data.emails:
+        prof = by_email[email]
+        wished = []
+        for conf in popular.sample(rng.randint(0, 4)):
+            if conf.seatsAvailable > 0:
+                conf.seatsAvailable -= 1
+                prof.conferenceKeysToAttend.append(conf.key)
+                conf_sessions = data.sessions_by_conference[conf.key]
+                wished.extend(rng.sample(
+                    conf_sessions, min(len(conf_sessions), rng.randint(0, 3))))
+        prof.wishListSessionKeys = wished
+        prof.wishListIntervals = buildIndex(
+            [sessions_by_key[k] for k in wished])
+
+    _putAll(profile_entities)
+    _putAll(speaker_entities)
+    _putAll(conference_entities)
+    _putAll(session_entities)
+    return data
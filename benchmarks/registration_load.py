@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""
+registration_load.py -- flash-crowd registration simulator on the local
+    testbed
+
+Many threads, each acting as its own user, register for (and sometimes
+unregister from) a single conference at once. For every registration
+strategy it reports throughput, transaction retries, contention
+failures and whether the final seat count matches the registrations.
+
+A strategy is a function (api, request, register) that registers
+(register=True) or unregisters the current user; add one to STRATEGIES
+to compare it with the others.
+
+Usage:
+    python benchmarks/registration_load.py [--threads N] [--seats N] \\
+        [--ops N] [--unregister-rate F] [--strategy NAME ...]
+
+$Id$
+
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+from sdk import activateTestbed
+from sdk import actAs
+from sdk import liftRateLimits
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+from conference import CONF_GET_REQUEST
+from conference import ConferenceApi
+from conference import ConflictException
+from instrumentation import startRecording
+from instrumentation import stopRecording
+from models import Conference
+from models import Profile
+
+
+def transactional(api, request, register):
+    """The ConferenceApi endpoints, as served today."""
+    if register:
+        return api.registerForConference(request)
+    return api.unregisterFromConference(request)
+
+
+def retryOnContention(api, request, register, attempts=5):
+    """The endpoints, with client-side retries after contention failures."""
+    for attempt in range(attempts):
+        try:
+            return transactional(api, request, register)
+        except datastore_errors.TransactionFailedError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+
+STRATEGIES = {
+    'transactional': transactional,
+    'retryOnContention': retryOnContention,
+}
+
+
+class Tally(object):
+    """Thread-safe outcome counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name, count=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + count
+
+
+def _worker(strategy, api, request, email, ops, unregister_rate, seed,
+            tally, start_gate):
+    actAs(email)
+    rng = random.Random(seed)
+    registered = False
+    start_gate.wait()
+    for _ in range(ops):
+        register = not registered or rng.random() >= unregister_rate
+        startRecording()
+        try:
+            strategy(api, request, register)
+            registered = register
+            tally.add('registered' if register else 'unregistered')
+        except ConflictException:
+            tally.add('conflict')  # sold out or already registered
+        except datastore_errors.TransactionFailedError:
+            tally.add('contentionFailure')
+        except Exception:
+            tally.add('error')
+        finally:
+            calls = stopRecording()
+        transactions = sum(1 for name, _ in calls
+                           if name == 'datastore_v3.BeginTransaction')
+        tally.add('attempts')
+        # every BeginTransaction beyond the first is a retry
+        tally.add('transactionRetries', max(transactions - 1, 0))
+
+
+def simulate(strategy, threads, seats, ops, unregister_rate, seed):
+    """Run one flash crowd against a fresh conference; return results."""
+    organizer = ndb.Key(Profile, 'organizer@example.com')
+    conf = Conference(key=ndb.Key(Conference, seed, parent=organizer),
+                      name='Hot Conference %d' % seed,
+                      organizerUserId='organizer@example.com',
+                      maxAttendees=seats, seatsAvailable=seats)
+    conf.put()
+    wsck = conf.key.urlsafe()
+    request = CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+
+    api = ConferenceApi()
+    tally = Tally()
+    start_gate = threading.Event()
+    emails = ['crowd%d-%d@example.com' % (seed, i) for i in range(threads)]
+    workers = [threading.Thread(target=_worker, args=(
+        strategy, api, request, email, ops, unregister_rate, seed * 1000 + i,
+        tally, start_gate)) for i, email in enumerate(emails)]
+    for worker in workers:
+        worker.start()
+    start = time.time()
+    start_gate.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    # final consistency: seats taken must equal registered profiles
+    conf = conf.key.get(use_cache=False, use_memcache=False)
+    profiles = ndb.get_multi([ndb.Key(Profile, email) for email in emails],
+                             use_cache=False, use_memcache=False)
+    attendees = sum(1 for p in profiles
+                    if p and conf.key in p.conferenceKeysToAttend)
+    counts = tally.counts
+    successes = counts.get('registered', 0) + counts.get('unregistered', 0)
+    return {
+        'threads': threads,
+        'seats': seats,
+        'seconds': round(elapsed, 4),
+        'successfulOpsPerSec': round(successes / elapsed, 2),
+        'outcomes': counts,
+        'finalSeatsAvailable': conf.seatsAvailable,
+        'registeredProfiles': attendees,
+        'seatCountCorrect': (conf.seatsAvailable >= 0 and
+                             conf.seatsAvailable + attendees == seats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--seats', type=int, default=20)
+    parser.add_argument('--ops', type=int, default=4,
+                        help='operations per thread')
+    parser.add_argument('--unregister-rate', type=float, default=0.3,
+                        help='chance a registered user unregisters next')
+    parser.add_argument('--strategy', action='append',
+                        choices=sorted(STRATEGIES),
+                        help='strategy to run (repeatable; default all)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bed = activateTestbed()
+    liftRateLimits()
+    try:
+        results = {}
+        for i, name in enumerate(args.strategy or sorted(STRATEGIES)):
+            results[name] = simulate(
+                STRATEGIES[name], args.threads, args.seats, args.ops,
+                args.unregister_rate, args.seed + i)
+    finally:
+        bed.deactivate()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+"""
+run.py -- Conference Central benchmark suite on the local testbed
+
+Generates a synthetic data set, runs timed scenarios against the
+ConferenceApi and the background tasks, and prints ops/sec and RPCs per
+operation as JSON. Save a run and pass it to --compare to flag
+regressions. Ops that raise are counted, and the first traceback of each
+scenario is printed; a run with any failed op exits with status 1, since
+its timings don't measure the intended path.
+
+Usage:
+    python benchmarks/run.py [--iterations N] [--profiles N] ... \\
+        [--output results.json] [--compare baseline.json]
+
+$Id$
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import traceback
+
+from sdk import activateTestbed
+from sdk import actAs
+from sdk import liftRateLimits
+from sdk import setupSdk
+setupSdk()
+
+from google.appengine.ext import ndb
+
+import datagen
+import worker
+from conference import CONF_CACHED_GET_REQUEST
+from conference import CONF_GET_REQUEST
+from conference import ConferenceApi
+from conference import CONF_QUERY_REQUEST
+from conference import SESSION_GET_REQUEST
+from conference import SESSION_LIST_REQUEST
+from conference import SESSION_WISHLIST_POST_REQUEST
+from instrumentation import startRecording
+from instrumentation import stopRecording
+from instrumentation import summarize
+from models import ConferenceQueryForm
+from models import Profile
+
+
+SCENARIOS = []
+_etags = {}
+_targets = {}
+
+
+def scenario(func):
+    """Register a benchmark scenario: func(api, data, i) runs one op."""
+    SCENARIOS.append(func)
+    return func
+
+
+def _hotConference(data):
+    return data.conference_keys[0]
+
+
+def _registrationTarget(data):
+    """Return the most popular conference with a seat left, and the
+    users not registered for it, so that every registration succeeds."""
+    if 'registration' not in _targets:
+        for c_key in data.conference_keys:
+            if c_key.get().seatsAvailable > 0:
+                break
+        registered = set(prof.key.id() for prof in Profile.query(
+            Profile.conferenceKeysToAttend == c_key))
+        _targets['registration'] = (
+            c_key, [email for email in data.emails if email not in registered])
+    return _targets['registration']
+
+
+@scenario
+def queryConferences(api, data, i):
+    city = datagen.CITIES[i % 3]
+    api.queryConferences(CONF_QUERY_REQUEST.combined_message_class(filters=[
+        ConferenceQueryForm(field='CITY', operator='EQ', value=city)]))
+
+
+@scenario
+def queryConferencesMasked(api, data, i):
+    api.queryConferences(CONF_QUERY_REQUEST.combined_message_class(
+        fieldMask='name,city,startDate,websafeKey'))
+
+
+@scenario
+def getConferenceNotModified(api, data, i):
+    # the warm up call stores the etag; later calls revalidate it
+    request = CONF_CACHED_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=_hotConference(data).urlsafe(),
+        ifNoneMatch=_etags.get('getConference'))
+    _etags['getConference'] = api.getConference(request).etag
+
+
+@scenario
+def getConferenceDetail(api, data, i):
+    actAs(data.emails[i % len(data.emails)])
+    api.getConferenceDetail(CONF_CACHED_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=_hotConference(data).urlsafe()))
+
+
+@scenario
+def getConferenceSessions(api, data, i):
+    api.getConferenceSessions(SESSION_LIST_REQUEST.combined_message_class(
+        websafeConferenceKey=_hotConference(data).urlsafe()))
+
+
+@scenario
+def getConferenceSessionsMasked(api, data, i):
+    api.getConferenceSessions(SESSION_LIST_REQUEST.combined_message_class(
+        websafeConferenceKey=_hotConference(data).urlsafe(),
+        fieldMask='name,startTime,websafeKey'))
+
+
+@scenario
+def getConferenceSpeakers(api, data, i):
+    api.getConferenceSpeakers(SESSION_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=_hotConference(data).urlsafe()))
+
+
+@scenario
+def registerUnregister(api, data, i):
+    c_key, emails = _registrationTarget(data)
+    actAs(emails[i % len(emails)])
+    request = CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=c_key.urlsafe())
+    api.registerForConference(request)
+    api.unregisterFromConference(request)
+
+
+@scenario
+def addSessionToWishlist(api, data, i):
+    actAs(data.emails[i % len(data.emails)])
+    session_key = data.session_keys[(i * 7919) % len(data.session_keys)]
+    api.addSessionToWishlist(
+        SESSION_WISHLIST_POST_REQUEST.combined_message_class(
+            websafeSessionKey=session_key.urlsafe()))
+
+
+@scenario
+def cacheFeaturedSpeaker(api, data, i):
+    worker.cacheFeaturedSpeaker(_hotConference(data).urlsafe())
+
+
+def runScenario(func, api, data, iterations):
+    """Time iterations of a scenario; return its result dict."""
+    ndb.get_context().clear_cache()
+    func(api, data, 0)  # warm up
+    totals, errors, first_error, elapsed = {}, 0, None, 0.0
+    for i in range(1, iterations + 1):
+        # every op starts with a fresh in-context cache, like a request
+        ndb.get_context().clear_cache()
+        startRecording()
+        start = time.time()
+        try:
+            func(api, data, i)
+        except Exception:
+            errors += 1
+            if first_error is None:
+                first_error = traceback.format_exc()
+                sys.stderr.write('%s op %d failed:\n%s' % (
+                    func.__name__, i, first_error))
+        finally:
+            elapsed += time.time() - start
+            _, summary = summarize(stopRecording())
+        for category, count in summary.items():
+            totals[category] = totals.get(category, 0) + count
+    return {
+        'ops': iterations,
+        'errors': errors,
+        'firstError': first_error and first_error.strip().split('\n')[-1],
+        'seconds': round(elapsed, 4),
+        'opsPerSec': round(iterations / elapsed, 2) if elapsed else None,
+        'rpcsPerOp': dict((category, round(count / float(iterations), 2))
+                          for category, count in totals.items()),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return regressions of results against a baseline run."""
+    regressions = []
+    for name, result in sorted(results['scenarios'].items()):
+        if result['errors']:
+            regressions.append('%s: %d of %d ops failed' % (
+                name, result['errors'], result['ops']))
+        base = baseline.get('scenarios', {}).get(name)
+        if not base or base.get('errors'):
+            continue
+        if base['opsPerSec'] and result['opsPerSec'] < \
+                base['opsPerSec'] * (1 - tolerance):
+            regressions.append('%s: %.1f ops/sec, baseline %.1f' % (
+                name, result['opsPerSec'], base['opsPerSec']))
+        for category, count in sorted(result['rpcsPerOp'].items()):
+            if count > base['rpcsPerOp'].get(category, 0):
+                regressions.append('%s: %.2f %s per op, baseline %.2f' % (
+                    name, count, category,
+                    base['rpcsPerOp'].get(category, 0)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--profiles', type=int, default=500)
+    parser.add_argument('--conferences', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=8,
+                        help='average sessions per conference')
+    parser.add_argument('--speakers', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', action='append',
+                        help='run only this scenario (repeatable)')
+    parser.add_argument('--output', help='also write the JSON results here')
+    parser.add_argument('--compare', help='baseline JSON results')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed ops/sec drop against the baseline')
+    args = parser.parse_args()
+
+    bed = activateTestbed()
+    liftRateLimits()
+    try:
+        data = datagen.generate(
+            profiles=args.profiles, conferences=args.conferences,
+            sessions_per_conference=args.sessions, speakers=args.speakers,
+            seed=args.seed)
+        actAs(data.emails[0])
+        api = ConferenceApi()
+        results = {
+            'meta': {
+                'python': platform.python_version(),
+                'iterations': args.iterations,
+                'profiles': args.profiles,
+                'conferences': args.conferences,
+                'sessions': len(data.session_keys),
+                'speakers': args.speakers,
+                'seed': args.seed,
+            },
+            'scenarios': {},
+        }
+        for func in SCENARIOS:
+            if args.only and func.__name__ not in args.only:
+                continue
+            results['scenarios'][func.__name__] = runScenario(
+                func, api, data, args.iterations)
+    finally:
+        bed.deactivate()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    failed = [name for name, result in sorted(results['scenarios'].items())
+              if result['errors']]
+    for name in failed:
+        sys.stderr.write('ERRORS %s: %d of %d ops failed\n' % (
+            name, results['scenarios'][name]['errors'], args.iterations))
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            sys.stderr.write('REGRESSION %s\n' % regression)
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+sdk.py -- make the App Engine SDK and the application importable from
+    the benchmark scripts, and set up the local testbed
+
+The SDK is found through the APPENGINE_SDK environment variable, or else
+by locating dev_appserver.py on the PATH.
+
+$Id$
+
+"""
+
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _findSdk():
+    sdk = os.environ.get('APPENGINE_SDK')
+    if sdk:
+        return sdk
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, 'dev_appserver.py')
+        if os.path.exists(candidate):
+            return os.path.dirname(os.path.realpath(candidate))
+    sys.exit('App Engine SDK not found; set APPENGINE_SDK to the directory '
+             'containing dev_appserver.py')
+
+
+def setupSdk():
+    """Put the SDK, its bundled libraries and the app on sys.path."""
+    sdk = _findSdk()
+    if sdk not in sys.path:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault('APPLICATION_ID', 'dev~conference-organizer')
+
+
+def activateTestbed():
+    """Activate testbed stubs for the services the app uses.
+
+    The datastore uses a consistency policy that always applies writes,
+    so benchmark queries see what the generator wrote. Returns the
+    active Testbed; call deactivate() on it when done.
+    """
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id=os.environ['APPLICATION_ID'], overwrite=True)
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_mail_stub()
+    bed.init_search_stub()
+    bed.init_app_identity_stub()
+    bed.init_user_stub()
+    bed.init_urlfetch_stub()
+    return bed
+
+
+_currentUser = threading.local()
+
+
+def actAs(email):
+    """Make endpoints.get_current_user() return email's user, per thread.
+
+    Endpoints normally reads the user from os.environ, which all threads
+    share; benchmark threads need their own users.
+    """
+    import endpoints
+    from google.appengine.api import users
+    if not getattr(endpoints, '_benchmarkUser', False):
+        endpoints.get_current_user = \
+            lambda: getattr(_currentUser, 'user', None)
+        endpoints._benchmarkUser = True
+    _currentUser.user = users.User(email, 'gmail.com') if email else None
+
+
+def liftRateLimits():
+    """Give every rate limit budget a practically endless bucket.
+
+    The buckets are still read and updated, so their cost is measured,
+    but benchmarks replaying many calls per user are never throttled.
+    """
+    import ratelimit
+    ratelimit.RATE_LIMITS = dict.fromkeys(ratelimit.RATE_LIMITS,
+                                          (10 ** 9, 10 ** 9))
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""
+build_static.py -- Conference Central front-end build: bundles,
+    minifies and fingerprints the scripts and stylesheets
+
+Concatenates the scripts, plus the partials inlined into Angular's
+$templateCache so that routes and dialogs need no template requests,
+into static/build/app.<content hash>.js, and the stylesheets into
+static/build/app.<content hash>.css. It then rewrites the asset blocks
+of templates/index.html to load them. app.yaml serves /build with a
+far-future expiration: changed content gets a new file name, so cached
+files never need revalidating.
+
+The minifiers only strip comments and whitespace, and use nothing
+outside the standard library.
+
+Usage:
+    python build_static.py          # before deploying
+    python build_static.py --dev    # back to the separate source files
+
+$Id$
+
+"""
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX = os.path.join(ROOT, 'templates', 'index.html')
+BUILD_DIR = os.path.join(ROOT, 'static', 'build')
+BUILD_URL = '/build/'
+ANGULAR_MODULE = 'conferenceApp'
+
+# (source file, URL app.yaml serves it at), in load order
+JS_SOURCES = [
+    ('static/js/app.js', '/js/app.js'),
+    ('static/js/controllers.js', '/js/controllers.js'),
+]
+CSS_SOURCES = [
+    ('static/bootstrap/css/bootstrap-cosmo.css', '/css/bootstrap-cosmo.css'),
+    ('static/bootstrap/css/main.css', '/css/main.css'),
+    ('static/bootstrap/css/offcanvas.css', '/css/offcanvas.css'),
+]
+PARTIALS = ('static/partials', '/partials/')
+
+TAGS = {
+    'js': '<script src="%s"></script>',
+    'css': '<link rel="stylesheet" href="%s">',
+}
+_ASSET_BLOCK = re.compile(
+    r'^([ \t]*)<!-- assets:(js|css) -->$.*?<!-- /assets:\2 -->$',
+    re.M | re.S)
+
+# characters after which a "/" starts a regular expression, not a division
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+
+
+def _read(path):
+    with io.open(os.path.join(ROOT, path), encoding='utf-8') as f:
+        return f.read()
+
+
+def minifyJs(source):
+    """Strip comments and redundant whitespace from JavaScript.
+
+    Strings and regular expression literals are copied verbatim. Line
+    breaks are kept, so automatic semicolon insertion is unaffected.
+    """
+    out, i, n = [], 0, len(source)
+    last = ''  # last significant character copied
+    while i < n:
+        c = source[i]
+        if c in '\'"':
+            j = i + 1
+            while j < n and source[j] not in (c, '\n'):
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            last, i = c, j + 1
+        elif source.startswith('//', i):
+            j = source.find('\n', i)
+            i = n if j < 0 else j
+        elif source.startswith('/*', i):
+            j = source.find('*/', i + 2)
+            i = n if j < 0 else j + 2
+            out.append(' ')
+        elif c == '/' and (not last or last in _REGEX_PRECEDERS):
+            j, in_class = i + 1, False
+            while j < n and source[j] != '\n':
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                elif source[j] == '/' and not in_class:
+                    break
+                j += 1
+            out.append(source[i:j + 1])
+            last, i = '/', j + 1
+        elif c.isspace():
+            j = i
+            while j < n and source[j].isspace():
+                j += 1
+            out.append('\n' if '\n' in source[i:j] else ' ')
+            i = j
+        else:
+            out.append(c)
+            last, i = c, i + 1
+    lines = (line.strip() for line in ''.join(out).split('\n'))
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def minifyCss(source):
+    """Strip comments and redundant whitespace from CSS."""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r' ?([{};,>]) ?', r'\1', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def templateCacheJs():
+    """Return a script putting every partial into Angular's
+    $templateCache, under the URL it is requested by."""
+    directory, url = PARTIALS
+    puts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, directory, '*.html'))):
+        name = os.path.basename(path)
+        puts.append('$templateCache.put(%s, %s);' % (
+            json.dumps(url + name),
+            json.dumps(_read(os.path.join(directory, name)))))
+    return ("angular.module(%s).run(['$templateCache', "
+            "function ($templateCache) {\n%s\n}]);\n" %
+            (json.dumps(ANGULAR_MODULE), '\n'.join(puts)))
+
+
+def _writeBundle(extension, content):
+    """Write content under its content hash; return its URL."""
+    data = content.encode('utf-8')
+    name = 'app.%s.%s' % (hashlib.md5(data).hexdigest()[:12], extension)
+    if not os.path.isdir(BUILD_DIR):
+        os.makedirs(BUILD_DIR)
+    with open(os.path.join(BUILD_DIR, name), 'wb') as f:
+        f.write(data)
+    return BUILD_URL + name
+
+
+def _removeStaleBundles(keep):
+    for path in glob.glob(os.path.join(BUILD_DIR, 'app.*.*')):
+        if BUILD_URL + os.path.basename(path) not in keep:
+            os.remove(path)
+
+
+def buildBundles():
+    """Write the bundles; return {'js': [URL], 'css': [URL]}."""
+    js = ';\n'.join(minifyJs(_read(path)) for path, _ in JS_SOURCES)
+    js += ';\n' + templateCacheJs()
+    css = ''.join(minifyCss(_read(path)) for path, _ in CSS_SOURCES)
+    urls = {'js': [_writeBundle('js', js)], 'css': [_writeBundle('css', css)]}
+    _removeStaleBundles(urls['js'] + urls['css'])
+    return urls
+
+
+def rewriteIndex(urls):
+    """Point the asset blocks of index.html at urls."""
+    def block(match):
+        indent, kind = match.group(1), match.group(2)
+        lines = ['<!-- assets:%s -->' % kind]
+        lines += [TAGS[kind] % url for url in urls[kind]]
+        lines.append('<!-- /assets:%s -->' % kind)
+        return '\n'.join(indent + line for line in lines)
+
+    html = _read(INDEX)
+    rewritten, count = _ASSET_BLOCK.subn(block, html)
+    if count != len(TAGS):
+        raise SystemExit('%s: expected one assets block per %s' %
+                         (INDEX, ' and '.join(sorted(TAGS))))
+    with io.open(INDEX, 'w', encoding='utf-8') as f:
+        f.write(rewritten)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--dev', action='store_true',
+                        help='load the separate, unminified source files')
+    args = parser.parse_args()
+    if args.dev:
+        urls = {'js': [url for _, url in JS_SOURCES],
+                'css': [url for _, url in CSS_SOURCES]}
+    else:
+        urls = buildBundles()
+    rewriteIndex(urls)
+    for kind in sorted(urls):
+        for url in urls[kind]:
+            print(url)
+
+
+if __name__ == '__main__':
+    main()
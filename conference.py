@@ -14,7 +14,7 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime
-from collections import Counter
+import httplib
 
 import endpoints
 from protorpc import messages
@@ -22,12 +22,12 @@ from protorpc import message_types
 from protorpc import remote
 
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 from google.appengine.api import memcache
 
 from models import StringMessage
-from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
@@ -35,12 +35,21 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceDetailForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import WebsafeKeysForm
+from models import ChangesForm
+from models import ConferenceSearchForms
+from models import ConferenceFacetsForm
 from models import TeeShirtSize
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionSearchForms
+from models import ConferenceScheduleForm
+from models import WishlistConflictForm
+from models import WishlistConflictForms
 from models import SessionType
 from models import Speaker
 from models import SpeakerForm
@@ -48,12 +57,67 @@ from models import SpeakerForms
 
 from utils import getUserId
 
+from instrumentation import instrumented
+
+from ratelimit import rateLimited
+
+from confirmation import enqueueConfirmationEmail
+
+from etags import bumpConferenceVersion
+from etags import conferenceVersion
+from etags import makeEtag
+
+from facets import conferenceFacets
+from facets import enqueueFacetUpdate
+from facets import getFacetCounts
+
+from ical import invalidateConferenceFeed
+from ical import invalidateWishlistFeed
+from ical import newFeedToken
+from ical import wishlistFeedPath
+
+from schedule import buildSchedule
+from schedule import copyScheduleToForm
+from schedule import enqueueScheduleBuild
+from schedule import scheduleKey
+
+from searchindex import enqueueIndexing
+from searchindex import queryConferenceIndex
+from searchindex import querySessionIndex
+
+from serializers import CONFERENCE_SERIALIZER
+from serializers import PROFILE_SERIALIZER
+from serializers import SESSION_SERIALIZER
+from serializers import fetchMasked
+from serializers import sessionsToForms
+from serializers import speakerNames
+
+from worker import MEMCACHE_ANNOUNCEMENTS_KEY
+from worker import MEMCACHE_FEATURED_SPEAKER_KEY
+from worker import announcementFromNearlySoldOut
+from worker import enqueueAnnouncementUpdate
+from worker import isNearlySoldOut
+
+from wishlist import addInterval
+from wishlist import allConflicts
+from wishlist import findConflicts
+from wishlist import loadIndex
+from wishlist import sessionInterval
+
+from recommendations import DEFAULT_RECOMMENDATIONS
+from recommendations import TOP_K
+from recommendations import recommendSessions
+
+from sync import changesSince
+from sync import formatWatermark
+from sync import parseWatermark
+
+from settings import FILTER_ARCHIVED
 from settings import WEB_CLIENT_ID
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER %s"
+MAX_KEYS_PER_BATCH = 100
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -92,6 +156,12 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_CACHED_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -99,6 +169,14 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 
 CONF_BY_TOPIC_REQUEST = endpoints.ResourceContainer(
     topic=messages.StringField(1),
+    fieldMask=messages.StringField(2),
+    includeArchived=messages.BooleanField(3),
+)
+
+CONF_QUERY_REQUEST = endpoints.ResourceContainer(
+    ConferenceQueryForms,
+    fieldMask=messages.StringField(2),
+    includeArchived=messages.BooleanField(3),
 )
 
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
@@ -106,6 +184,13 @@ SESSION_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSION_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fieldMask=messages.StringField(2),
+    ifNoneMatch=messages.StringField(3),
+)
+
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1),
@@ -114,13 +199,57 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
 SESSION_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     typeOfSession=messages.EnumField(SessionType, 1),
     websafeConferenceKey=messages.StringField(2),
+    fieldMask=messages.StringField(3),
+)
+
+SESSION_BY_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    SpeakerForm,
+    fieldMask=messages.StringField(2),
+)
+
+WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fieldMask=messages.StringField(1),
+)
+
+RECOMMENDED_SESSIONS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    limit=messages.IntegerField(1),
+    fieldMask=messages.StringField(2),
 )
 
 SESSION_WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    websafeSessionKey=messages.StringField(1)
+    websafeSessionKey=messages.StringField(1),
+    rejectConflicts=messages.BooleanField(2),
 )
 
+CHANGES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    since=messages.StringField(1),
+    cursor=messages.StringField(2),
+    limit=messages.IntegerField(3, variant=messages.Variant.INT32),
+)
+
+ANNOUNCEMENT_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    limit=messages.IntegerField(2, variant=messages.Variant.INT32),
+    cursor=messages.StringField(3),
+)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class ConflictException(endpoints.ServiceException):
+    """ConflictException -- exception mapped to HTTP 409 response"""
+    http_status = httplib.CONFLICT
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -132,22 +261,56 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName, mask=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        return CONFERENCE_SERIALIZER.toForm(conf, displayName, mask)
+
+    def _getByKeys(self, websafe_keys, kind):
+        """Fetch entities of a kind by websafe key, with one get_multi.
+
+        Returns (entities, not found websafe keys). Duplicate keys are
+        fetched and returned once; keys that don't decode, are of another
+        kind, app or namespace, are incomplete or have no entity are
+        reported as not found. The datastore would reject the whole batch
+        over one key of another app or namespace, or an incomplete one.
+        """
+        if len(websafe_keys) > MAX_KEYS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d keys per request' % MAX_KEYS_PER_BATCH)
+        # a new key takes the current app and namespace
+        local = ndb.Key(kind, 1)
+        keys, not_found, seen = [], [], set()
+        for websafe_key in websafe_keys:
+            if websafe_key in seen:
+                continue
+            seen.add(websafe_key)
+            try:
+                key = ndb.Key(urlsafe=websafe_key)
+            except Exception:
+                # malformed keys raise assorted decoding errors
+                key = None
+            if key is None or key.kind() != kind.__name__ or \
+                    key.app() != local.app() or \
+                    key.namespace() != local.namespace() or \
+                    key.id() is None:
+                not_found.append(websafe_key)
+            else:
+                keys.append((websafe_key, key))
+        entities = []
+        fetched = ndb.get_multi([key for _, key in keys])
+        for (websafe_key, _), entity in zip(keys, fetched):
+            if entity is None:
+                not_found.append(websafe_key)
+            else:
+                entities.append(entity)
+        return entities, not_found
+
+    def _fieldMask(self, serializer, fields):
+        """Parse a request's `fieldMask` for a serializer's form."""
+        try:
+            return serializer.parseMask(fields)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
 
 
     def _createConferenceObject(self, request):
@@ -161,27 +324,13 @@ class ConferenceApi(remote.Service):
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeKey']
-        del data['organizerDisplayName']
-
-        # add default values for those missing (both data model & outbound Message)
-        for df in CONFERENCE_DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = CONFERENCE_DEFAULTS[df]
-                setattr(request, df, CONFERENCE_DEFAULTS[df])
-
-        # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10],
-                                                  "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10],
-                                                "%Y-%m-%d").date()
+        # copy ConferenceForm/ProtoRPC Message into dict, adding default
+        # values for those missing (both data model & outbound Message) and
+        # converting dates from strings to Date objects
+        data = CONFERENCE_SERIALIZER.toEntityData(request, CONFERENCE_DEFAULTS)
+
+        # set month based on start_date
+        data['month'] = data['startDate'].month if data['startDate'] else 0
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
@@ -196,12 +345,13 @@ class ConferenceApi(remote.Service):
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(
-            params={'email': user.email(),
-                    'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf = Conference(**data)
+        conf.put()
+        enqueueIndexing(c_key)
+        enqueueFacetUpdate(set(), conferenceFacets(conf))
+        if isNearlySoldOut(conf):
+            enqueueAnnouncementUpdate(c_key)
+        enqueueConfirmationEmail(c_key, user.email())
 
         return request
 
@@ -227,6 +377,11 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        # remember facet values so counts can follow any moves
+        old_facets = conferenceFacets(conf)
+        old_name = conf.name
+        was_nearly_sold_out = isNearlySoldOut(conf)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
@@ -241,6 +396,14 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
+        enqueueIndexing(conf.key)
+        enqueueFacetUpdate(old_facets, conferenceFacets(conf))
+        nearly_sold_out = isNearlySoldOut(conf)
+        renamed = conf.name != old_name
+        if nearly_sold_out != was_nearly_sold_out or \
+                (renamed and nearly_sold_out):
+            # a listed conference's new name must reach the announcement
+            enqueueAnnouncementUpdate(conf.key, rebuild=renamed)
         prof = ndb.Key(Profile, user_id).get()
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
@@ -275,31 +438,11 @@ class ConferenceApi(remote.Service):
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
-        # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeKey']
-        del data['websafeConferenceKey']
-
-        # add default values for those missing (both data model & outbound Message)
-        for df in SESSION_DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = SESSION_DEFAULTS[df]
-                setattr(request, df, SESSION_DEFAULTS[df])
-
-        # convert session type to string
-        if data['typeOfSession']:
-            data['typeOfSession'] = str(data['typeOfSession'])
-
-        # convert dates from strings to Date and TimeDuration objects
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10],
-                                             "%Y-%m-%d").date()
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(data['startTime'][:5],
-                                                  "%H:%M").time()
-        if data['duration']:
-            data['duration'] = datetime.strptime(data['duration'][:5],
-                                                 "%H:%M").time()
+        # copy SessionForm/ProtoRPC Message into dict, adding default
+        # values for those missing (both data model & outbound Message),
+        # converting session type to string and dates from strings to
+        # Date and TimeDuration objects
+        data = SESSION_SERIALIZER.toEntityData(request, SESSION_DEFAULTS)
 
         # Transform list of speaker names into list of speaker keys
         # Speaker names are case-insensitive
@@ -323,37 +466,16 @@ class ConferenceApi(remote.Service):
 
         # creation of Session & return (modified) SessionForm
         Session(**data).put()
+        enqueueIndexing(s_key)
+        enqueueScheduleBuild(c_key)
         return self._copySessionToForm(s_key.get())
 
     def _copySessionToForm(self, session):
         """Copies relevant fields from a Session to a SessionForm.
-        """
-        # copy relevant fields from Session to SessionForm
-        session_form = SessionForm()
-        for field in session_form.all_fields():
-            if hasattr(session, field.name):
-                if field.name in ('date', 'startTime', 'duration'):
-                    setattr(session_form, field.name,
-                            str(getattr(session, field.name)))
-                elif field.name == 'typeOfSession':
-                    setattr(session_form, field.name,
-                            getattr(SessionType, getattr(session, field.name)))
-                elif field.name == 'speakers':
-                    setattr(session_form, field.name,
-                            [str(s.get().name) for s in session.speakers])
-                else:
-                    setattr(session_form, field.name,
-                            getattr(session, field.name))
-            elif field.name == "websafeKey":
-                setattr(session_form, field.name,
-                        session.key.urlsafe())
-            elif field.name == "websafeConferenceKey":
-                setattr(session_form, field.name,
-                        session.key.parent().urlsafe())
-
-        session_form.check_initialized()
 
-        return session_form
+        Use sessionsToForms() for lists; it resolves speakers in one batch.
+        """
+        return SESSION_SERIALIZER.toForm(session, speakerNames([session]))
 
     def _getConferenceSessions(self, request):
         '''Given a conference, return all its sessions.'''
@@ -385,10 +507,15 @@ class ConferenceApi(remote.Service):
 
     # This modifies an existing resource. Although only a single user can
     # modify, it is marked transactional to avoid the risk of race conditions.
-    @ndb.transactional()
+    # It is cross-group because the session lives in its conference's group.
+    @ndb.transactional(xg=True)
     def _addSessionToWishlist(self, request):
         '''Add a session key to a user's wishlist.
 
+        Overlapping sessions are accepted, as users often wishlist talks
+        that clash; getWishlistConflicts reports them. Raises
+        ConflictException instead if request.rejectConflicts is set.
+
         Returns:
             BooleanMessage True if session added, False otherwise.
         '''
@@ -397,38 +524,55 @@ class ConferenceApi(remote.Service):
         # Check if session with right websafe session key exists
         # and raise if it doesn't
         ws_key = request.websafeSessionKey
-        session_key = ndb.Key(urlsafe=ws_key).get()
-        if not session_key:
+        s_key = ndb.Key(urlsafe=ws_key)
+        session = s_key.get()
+        if not session:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % ws_key)
 
         # check if session is already on the user wishlist
-        if ws_key in prof.wishListSessionKeys:
+        if s_key in prof.wishListSessionKeys:
             return BooleanMessage(data=False)
 
+        # check for overlaps against the wishlist's interval index
+        index = loadIndex(prof)
+        interval = sessionInterval(session)
+        conflicts = findConflicts(index, interval)
+        if conflicts and request.rejectConflicts:
+            raise ConflictException(
+                'Session overlaps sessions on your wishlist: %s' %
+                ', '.join(self._sessionNames(conflicts)))
+
         # add session to profile's withlist
-        prof.wishListSessionKeys.append(ws_key)
+        prof.wishListSessionKeys.append(s_key)
+        addInterval(index, interval)
 
         # write modified profile back to the datastore & return
         prof.put()
         return BooleanMessage(data=True)
 
 
+    @staticmethod
+    @ndb.non_transactional
+    def _sessionNames(websafe_keys):
+        '''Return the names of sessions, outside of any transaction.'''
+        sessions = ndb.get_multi([ndb.Key(urlsafe=k) for k in websafe_keys])
+        return [s.name for s in sessions if s]
+
     def _getSessionsInWishlist(self, request):
         '''Get a list of sessions for all sessions in a user's wish-list'''
 
         prof = self._getProfileFromUser()
 
         # get sessionsKeysOnWishlist from profile.
-        sessions = [ndb.Key(urlsafe=key) for key in
-                    prof.wishListSessionKeys]
-
-        return ndb.get_multi(sessions)
+        return ndb.get_multi(prof.wishListSessionKeys)
 
     #====== End points =========================================================
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
+    @instrumented
+    @rateLimited('createConference')
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -436,29 +580,132 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT', name='updateConference')
+    @instrumented
+    @rateLimited('updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        form = self._updateConferenceObject(request)
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        bumpConferenceVersion(c_key)
+        invalidateConferenceFeed(c_key)
+        return form
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_CACHED_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey).
+
+        Pass the etag of a previous reply as ifNoneMatch to get a
+        notModified reply, without the conference, if it is unchanged.
+        """
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        # take the version before reading, so a concurrent write can
+        # only make the ETag stale, never the cached copy
+        etag = makeEtag(conferenceVersion(c_key))
+        if request.ifNoneMatch == etag:
+            return ConferenceForm(etag=etag, notModified=True)
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = c_key.get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
         prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        form = self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        form.etag = etag
+        return form
+
+
+    @endpoints.method(CONF_CACHED_GET_REQUEST, ConferenceDetailForm,
+                      path='conference/{websafeConferenceKey}/detail',
+                      http_method='GET', name='getConferenceDetail')
+    @instrumented
+    def getConferenceDetail(self, request):
+        """Return a conference with everything its detail page shows.
+
+        That is the conference, its session count and featured speaker,
+        and whether the signed in viewer attends it and which of its
+        sessions they wish-listed. The lookups are issued together and
+        run in parallel. ifNoneMatch applies to the conference, as in
+        getConference; the viewer's status is always current.
+        """
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        user = endpoints.get_current_user()
+
+        etag = makeEtag(conferenceVersion(c_key))
+        conference_unchanged = request.ifNoneMatch == etag
+        if not conference_unchanged:
+            conf_future = c_key.get_async()
+            organizer_future = c_key.parent().get_async()
+        schedule_future = scheduleKey(c_key).get_async()
+        speaker_future = ndb.get_context().memcache_get(
+            MEMCACHE_FEATURED_SPEAKER_KEY % wsck)
+        if user:
+            viewer_future = ndb.Key(Profile, getUserId(user)).get_async()
+
+        detail = ConferenceDetailForm(
+            featuredSpeaker=speaker_future.get_result())
+        if conference_unchanged:
+            detail.conference = ConferenceForm(etag=etag, notModified=True)
+        else:
+            conf = conf_future.get_result()
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+            organizer = organizer_future.get_result()
+            detail.conference = self._copyConferenceToForm(
+                conf, getattr(organizer, 'displayName', None))
+            detail.conference.etag = etag
+
+        # the materialized schedule counts the sessions; only count them
+        # with a query when it has not been built yet
+        schedule = schedule_future.get_result()
+        if schedule is not None:
+            detail.sessionCount = schedule.sessionCount
+        else:
+            detail.sessionCount = Session.query(ancestor=c_key).count()
+
+        if user:
+            viewer = viewer_future.get_result()
+            detail.isAttending = bool(
+                viewer and c_key in viewer.conferenceKeysToAttend)
+            if viewer:
+                detail.wishListSessionKeys = [
+                    key.urlsafe() for key in viewer.wishListSessionKeys
+                    if key.parent() == c_key]
+        return detail
+
+
+    @endpoints.method(WebsafeKeysForm, ConferenceForms,
+                      path='conferences/by_keys',
+                      http_method='POST', name='getConferencesByKeys')
+    @instrumented
+    def getConferencesByKeys(self, request):
+        """Return the conferences with the given websafe keys.
+
+        Keys without a conference are listed in notFound.
+        """
+        confs, not_found = self._getByKeys(request.websafeKeys, Conference)
+        organizers = ndb.get_multi(list(set(conf.key.parent()
+                                            for conf in confs)))
+        names = dict((prof.key, prof.displayName)
+                     for prof in organizers if prof)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf,
+                                              names.get(conf.key.parent()))
+                   for conf in confs],
+            notFound=not_found
+        )
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -478,6 +725,8 @@ class ConferenceApi(remote.Service):
     def _getQuery(self, request):
         """Return formatted query from the submitted filters."""
         q = Conference.query()
+        if FILTER_ARCHIVED and not request.includeArchived:
+            q = q.filter(Conference.archived == False)
         inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
@@ -523,62 +772,166 @@ class ConferenceApi(remote.Service):
         return (inequality_field, formatted_filters)
 
 
-    @endpoints.method(ConferenceQueryForms, ConferenceForms,
+    @endpoints.method(CONF_QUERY_REQUEST, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences.
+
+        An optional `fieldMask` (e.g. "name,city,startDate,websafeKey")
+        limits the returned fields; the organizer profiles are only
+        fetched if it includes organizerDisplayName. Conferences that
+        have ended and been archived are left out unless includeArchived
+        is set (once settings.FILTER_ARCHIVED is on).
+        """
+        mask = self._fieldMask(CONFERENCE_SERIALIZER, request.fieldMask)
+        conferences = fetchMasked(self._getQuery(request),
+                                  CONFERENCE_SERIALIZER, mask)
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
         names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        if mask is None or 'organizerDisplayName' in mask:
+            organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
+            profiles = ndb.get_multi(organisers)
+
+            # put display names in a dict for easier fetching
+            for profile in profiles:
+                if profile:
+                    names[profile.key.id()] = profile.displayName
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
+                items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId), mask) for conf in \
                 conferences]
         )
 
     @endpoints.method(CONF_BY_TOPIC_REQUEST, ConferenceForms,
                       path='conference/by_topic/{topic}',
                       http_method='GET', name='getConferencesByTopic')
+    @instrumented
     def getConferencesByTopic(self, request):
-        """ Returns all conferences with a certain topic."""
+        """ Returns all conferences with a certain topic.
+
+        Archived conferences are left out unless includeArchived is set
+        (once settings.FILTER_ARCHIVED is on).
+        """
         # check request has  topic field
         if not request.topic:
             raise endpoints.BadRequestException("Conference 'topic' field \
                 required")
+        mask = self._fieldMask(CONFERENCE_SERIALIZER, request.fieldMask)
         # get all conferences filtered by topic and order them by name
         confs = Conference.query().filter(
             Conference.topics.IN([request.topic])).order(Conference.name)
+        if FILTER_ARCHIVED and not request.includeArchived:
+            confs = confs.filter(Conference.archived == False)
         # return set of ConferenceForms
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in confs]
+            items=[self._copyConferenceToForm(conf, "", mask) for conf in
+                   fetchMasked(confs, CONFERENCE_SERIALIZER, mask)]
+        )
+
+    @endpoints.method(message_types.VoidMessage, ConferenceFacetsForm,
+                      path='conferences/facets',
+                      http_method='GET', name='getConferenceFacets')
+    @instrumented
+    def getConferenceFacets(self, request):
+        """Return conference counts per city, topic and month."""
+        return getFacetCounts()
+
+# - - - Delta sync - - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(CHANGES_GET_REQUEST, ChangesForm,
+                      path='changes',
+                      http_method='GET', name='getChangesSince')
+    @instrumented
+    def getChangesSince(self, request):
+        """Return conferences and sessions changed since a watermark.
+
+        Omit `since` for a full sync. Page with `cursor` until it comes
+        back empty, then keep the returned watermark for the next sync.
+        """
+        try:
+            since = parseWatermark(request.since) if request.since else None
+            conferences, sessions, cursor, watermark = changesSince(
+                since, request.cursor, request.limit)
+        except ValueError as e:
+            raise endpoints.BadRequestException(str(e))
+
+        organizers = ndb.get_multi(list(set(conf.key.parent()
+                                            for conf in conferences)))
+        names = dict((prof.key, prof.displayName)
+                     for prof in organizers if prof)
+        return ChangesForm(
+            conferences=[self._copyConferenceToForm(
+                conf, names.get(conf.key.parent())) for conf in conferences],
+            sessions=sessionsToForms(sessions),
+            cursor=cursor,
+            watermark=formatWatermark(watermark)
+        )
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _searchIndex(self, request, query_index):
+        """Run a keyword search, returning (entities, cursor, number found)."""
+        if not request.query:
+            raise endpoints.BadRequestException("Search 'query' field required")
+        try:
+            keys, next_cursor, number_found = query_index(
+                request.query, request.limit, request.cursor)
+        except (search.QueryError, ValueError):
+            raise endpoints.BadRequestException(
+                'Invalid search query or cursor.')
+        # documents can briefly outlive their entities; skip those
+        entities = [e for e in ndb.get_multi(keys) if e is not None]
+        return entities, next_cursor, number_found
+
+    @endpoints.method(SEARCH_GET_REQUEST, ConferenceSearchForms,
+                      path='search/conferences',
+                      http_method='GET', name='searchConferences')
+    @instrumented
+    def searchConferences(self, request):
+        """Keyword search over conference name, description, topics & city."""
+        confs, next_cursor, number_found = self._searchIndex(
+            request, queryConferenceIndex)
+
+        # fetch organiser displayNames with a single get_multi
+        organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                         for conf in confs)
+        names = {}
+        for profile in ndb.get_multi(list(organisers)):
+            if profile:
+                names[profile.key.id()] = profile.displayName
+
+        return ConferenceSearchForms(
+            items=[self._copyConferenceToForm(
+                conf, names.get(conf.organizerUserId)) for conf in confs],
+            nextCursor=next_cursor,
+            numberFound=number_found
+        )
+
+    @endpoints.method(SEARCH_GET_REQUEST, SessionSearchForms,
+                      path='search/sessions',
+                      http_method='GET', name='searchSessions')
+    @instrumented
+    def searchSessions(self, request):
+        """Keyword search over session name, highlights & speakers."""
+        sessions, next_cursor, number_found = self._searchIndex(
+            request, querySessionIndex)
+        return SessionSearchForms(
+            items=sessionsToForms(sessions),
+            nextCursor=next_cursor,
+            numberFound=number_found
         )
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_SERIALIZER.toForm(prof)
 
 
     def _getProfileFromUser(self):
@@ -612,6 +965,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            old_display_name = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -622,6 +976,12 @@ class ConferenceApi(remote.Service):
                         #else:
                         #    setattr(prof, field, val)
             prof.put()
+            # organizerDisplayName is part of their conferences' replies
+            if prof.displayName != old_display_name:
+                c_keys = Conference.query(ancestor=prof.key).fetch(
+                    keys_only=True)
+                if c_keys:
+                    bumpConferenceVersion(*c_keys)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -629,6 +989,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -636,6 +997,8 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrumented
+    @rateLimited('saveProfile')
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -652,15 +1015,17 @@ class ConferenceApi(remote.Service):
         # check if conf exists given websafeConferenceKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        was_nearly_sold_out = isNearlySoldOut(conf)
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if c_key in prof.conferenceKeysToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
@@ -670,17 +1035,17 @@ class ConferenceApi(remote.Service):
                     "There are no seats available.")
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
+            prof.conferenceKeysToAttend.append(c_key)
             conf.seatsAvailable -= 1
             retval = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if c_key in prof.conferenceKeysToAttend:
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
+                prof.conferenceKeysToAttend.remove(c_key)
                 conf.seatsAvailable += 1
                 retval = True
             else:
@@ -689,17 +1054,22 @@ class ConferenceApi(remote.Service):
         # write things back to the datastore & return
         prof.put()
         conf.put()
+
+        # refresh the announcement only when the conference crosses the
+        # nearly sold out threshold
+        if isNearlySoldOut(conf) != was_nearly_sold_out:
+            enqueueAnnouncementUpdate(conf.key)
         return BooleanMessage(data=retval)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        conferences = ndb.get_multi(prof.conferenceKeysToAttend)
 
         # get organizers
         organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
@@ -720,20 +1090,31 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @instrumented
+    @rateLimited('registration')
     def registerForConference(self, request):
         """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        result = self._conferenceRegistration(request)
+        bumpConferenceVersion(ndb.Key(urlsafe=request.websafeConferenceKey))
+        return result
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @instrumented
+    @rateLimited('registration')
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        result = self._conferenceRegistration(request, reg=False)
+        if result.data:
+            bumpConferenceVersion(
+                ndb.Key(urlsafe=request.websafeConferenceKey))
+        return result
 
     @endpoints.method(SESSION_GET_REQUEST, SpeakerForms,
                       path='conference/{websafeConferenceKey}/speakers',
                       http_method='GET', name='getConferenceSpeakers')
+    @instrumented
     def getConferenceSpeakers(self, request):
         '''Given a conference, return all speakers'''
         sessions = self._getConferenceSessions(request)
@@ -745,73 +1126,212 @@ class ConferenceApi(remote.Service):
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - - - -
 
-    @endpoints.method(SESSION_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_LIST_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
-        '''Given a conference, return all sessions'''
+        '''Given a conference, return all sessions
+
+        Pass the etag of a previous reply as ifNoneMatch to get a
+        notModified reply, without sessions, if they are unchanged.
+        '''
+        mask = self._fieldMask(SESSION_SERIALIZER, request.fieldMask)
+        etag = makeEtag(conferenceVersion(
+            ndb.Key(urlsafe=request.websafeConferenceKey)), request.fieldMask)
+        if request.ifNoneMatch == etag:
+            return SessionForms(etag=etag, notModified=True)
         sessions = self._getConferenceSessions(request)
         return SessionForms(
-            items=[self._copySessionToForm(s) for s in sessions]
+            items=sessionsToForms(
+                fetchMasked(sessions, SESSION_SERIALIZER, mask), mask),
+            etag=etag
         )
 
+    @endpoints.method(SESSION_GET_REQUEST, ConferenceScheduleForm,
+                      path='conference/{websafeConferenceKey}/schedule',
+                      http_method='GET', name='getConferenceSchedule')
+    @instrumented
+    def getConferenceSchedule(self, request):
+        '''Given a conference, return its sessions grouped by day and time'''
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        schedule = scheduleKey(c_key).get()
+        if schedule is None:
+            # not materialized yet: build it now if the conference exists
+            if not c_key.get():
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s'
+                    % request.websafeConferenceKey)
+            schedule = buildSchedule(c_key)
+        return copyScheduleToForm(c_key, schedule)
+
     @endpoints.method(SESSION_BY_TYPE_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions/by_type',
                       http_method='GET', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         '''Get all the sessions of a certain type in a conference'''
+        mask = self._fieldMask(SESSION_SERIALIZER, request.fieldMask)
         # Get all conference sessions filtered by typeOfSession
         sessions = self._getConferenceSessions(request).filter(
             Session.typeOfSession == str(request.typeOfSession))
         return SessionForms(
-            items=[self._copySessionToForm(s) for s in sessions]
+            items=sessionsToForms(
+                fetchMasked(sessions, SESSION_SERIALIZER, mask), mask)
         )
 
-    @endpoints.method(SpeakerForm, SessionForms,
+    @endpoints.method(SESSION_BY_SPEAKER_GET_REQUEST, SessionForms,
                       path='sessions/by_speaker',
                       http_method='GET', name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
         '''Given a speaker, return all sessions given \
         by this particular speaker, across all conferences
         '''
+        mask = self._fieldMask(SESSION_SERIALIZER, request.fieldMask)
         sessions = self._getSessionsBySpeaker(request)
         return SessionForms(
-            items=[self._copySessionToForm(s) for s in sessions]
+            items=sessionsToForms(
+                fetchMasked(sessions, SESSION_SERIALIZER, mask), mask)
+        )
+
+    @endpoints.method(WebsafeKeysForm, SessionForms,
+                      path='sessions/by_keys',
+                      http_method='POST', name='getSessionsByKeys')
+    @instrumented
+    def getSessionsByKeys(self, request):
+        '''Return the sessions with the given websafe keys
+
+        Keys without a session are listed in notFound.
+        '''
+        sessions, not_found = self._getByKeys(request.websafeKeys, Session)
+        return SessionForms(
+            items=sessionsToForms(sessions),
+            notFound=not_found
         )
 
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='POST', name='createSession')
+    @instrumented
+    @rateLimited('createSession')
     def createSession(self, request):
         """ Creates a new session for a conference."""
-        return self._createSessionObject(request)
+        form = self._createSessionObject(request)
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        bumpConferenceVersion(c_key)
+        invalidateConferenceFeed(c_key)
+        return form
 
 
     @endpoints.method(SESSION_WISHLIST_POST_REQUEST, BooleanMessage,
                       path='wishlist',
                       http_method='POST', name='addSessionToWishlist')
+    @instrumented
+    @rateLimited('wishlist')
     def addSessionToWishlist(self, request):
         ''' Add a session to user's wish-list.
 
         Take no action if session is already on list.
         '''
-        return self._addSessionToWishlist(request)
+        result = self._addSessionToWishlist(request)
+        if result.data:
+            prof = ndb.Key(Profile,
+                           getUserId(endpoints.get_current_user())).get()
+            invalidateWishlistFeed(prof.feedToken)
+        return result
+
+    @ndb.transactional()
+    def _wishlistFeedToken(self, rotate):
+        '''Return the user's (new, old) feed tokens, creating the token
+        if there is none yet or rotate is set.'''
+        prof = self._getProfileFromUser()
+        old = prof.feedToken
+        if rotate or not old:
+            prof.feedToken = newFeedToken()
+            prof.put()
+        return prof.feedToken, old
 
+    @endpoints.method(message_types.VoidMessage, StringMessage,
+                      path='wishlist/feed',
+                      http_method='GET', name='getWishlistFeedUrl')
+    @instrumented
+    def getWishlistFeedUrl(self, request):
+        '''Get the path of the user's wish-list iCalendar feed.
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+        The path is secret: anyone with it can read the wish-list.
+        '''
+        token, _ = self._wishlistFeedToken(rotate=False)
+        return StringMessage(data=wishlistFeedPath(token))
+
+    @endpoints.method(message_types.VoidMessage, StringMessage,
+                      path='wishlist/feed',
+                      http_method='POST', name='rotateWishlistFeedUrl')
+    @instrumented
+    def rotateWishlistFeedUrl(self, request):
+        '''Replace the user's wish-list feed path with a new one.
+
+        The old path stops working; returns the new one.
+        '''
+        token, old = self._wishlistFeedToken(rotate=True)
+        invalidateWishlistFeed(old)
+        return StringMessage(data=wishlistFeedPath(token))
+
+
+    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
                       path='wishlist',
                       http_method='GET', name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
         '''Get list of sessions in user's wish-list'''
+        mask = self._fieldMask(SESSION_SERIALIZER, request.fieldMask)
         sessions = self._getSessionsInWishlist(request)
         return SessionForms(
-            items=[self._copySessionToForm(s) for s in sessions]
+            items=sessionsToForms(sessions, mask)
+        )
+
+    @endpoints.method(RECOMMENDED_SESSIONS_GET_REQUEST, SessionForms,
+                      path='wishlist/recommendations',
+                      http_method='GET', name='getRecommendedSessions')
+    @instrumented
+    def getRecommendedSessions(self, request):
+        '''Get sessions like those in the user's wish-list, best first.
+
+        Served from the similar sessions precomputed by the daily
+        recommendations job (recommendations.py): up to limit sessions
+        (default 10), leaving out archived ones.
+        '''
+        mask = self._fieldMask(SESSION_SERIALIZER, request.fieldMask)
+        limit = max(1, min(request.limit or DEFAULT_RECOMMENDATIONS, TOP_K))
+        prof = self._getProfileFromUser()
+        sessions = ndb.get_multi(
+            recommendSessions(prof.wishListSessionKeys, limit))
+        return SessionForms(
+            items=sessionsToForms(
+                [s for s in sessions if s and not s.archived], mask)
+        )
+
+    @endpoints.method(message_types.VoidMessage, WishlistConflictForms,
+                      path='wishlist/conflicts',
+                      http_method='GET', name='getWishlistConflicts')
+    @instrumented
+    def getWishlistConflicts(self, request):
+        '''List sessions in user's wish-list that overlap each other'''
+        prof = self._getProfileFromUser()
+        # a missing index is only built in memory: the next wish-list add
+        # stores it, in a transaction
+        index = loadIndex(prof)
+        return WishlistConflictForms(
+            items=[WishlistConflictForm(websafeSessionKey=key,
+                                        conflictsWith=others)
+                   for key, others in allConflicts(index)]
         )
 
 # - - - Query problem - - - - - - - - - - - - - - - - - - - -
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='_query_problem', http_method='GET',
                       name='queryProblem')
+    @instrumented
     def queryProblem(self, request):
         '''Solution to the query problem
 
@@ -828,99 +1348,61 @@ class ConferenceApi(remote.Service):
             Session.startTime < datetime.strptime(latest_time,
                                                   '%I:%M %p').time()
         )
+        if FILTER_ARCHIVED:
+            sessions = sessions.filter(Session.archived == False)
 
         return SessionForms(
-            items=[self._copySessionToForm(s)
-                   for s in sessions if s.typeOfSession != 'Workshop']
+            items=sessionsToForms(
+                s for s in sessions if s.typeOfSession != 'Workshop')
         )
 
 # - - - Featured Speaker  - - - - - - - - - - - - - - - - - -
-    @endpoints.method(CONF_GET_REQUEST, StringMessage,
+    @endpoints.method(CONF_CACHED_GET_REQUEST, StringMessage,
                       path='conference/featured_speaker',
                       http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
-        '''Return the featured speaker of this conference from memcache.'''
-        # check if conf exists given websafeConferenceKey
-        websafe_key = request.websafeConferenceKey
-        conf_key = ndb.Key(urlsafe=websafe_key).get()
-        if not conf_key:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % websafe_key)
-
-        memcache_key = MEMCACHE_FEATURED_SPEAKER_KEY % websafe_key
+        '''Return the featured speaker of this conference from memcache.
 
-        return StringMessage(data=memcache.get(
-            memcache_key) or "No featured speakers.")
-
-    @staticmethod
-    def _cacheFeaturedSpeaker(websafe_key):
-        '''Update featured speaker for given conference
-
-        The fetured speaker is the speaker in most sessions in a conference.
-
-        Parameters:
-            websafe_key: websafe conference key string
+        The etag is a hash of the message; pass it back as ifNoneMatch.
         '''
-
-        # get count of speaker appearences in conference sessions
-        c_key = ndb.Key(urlsafe=websafe_key)
-        sessions = Session.query(ancestor=c_key)
-        speaker_count = Counter([s_key
-                                 for session in sessions
-                                 for s_key in session.speakers]).most_common()
-
-        # Get key of most frequent speaker
-        featured_speaker = speaker_count[0][0] if speaker_count else None
-
-        # Store featured speaker in memcache
-        memcache_key = MEMCACHE_FEATURED_SPEAKER_KEY % c_key.urlsafe()
-
-        if featured_speaker is not None:
-            msg = 'FEATURED SPEAKER: %s' % featured_speaker.get().name
-            memcache.set(memcache_key, msg)
-        else:
-            memcache.delete(memcache_key)
+        websafe_key = request.websafeConferenceKey
+        memcache_key = MEMCACHE_FEATURED_SPEAKER_KEY % websafe_key
+        message = memcache.get(memcache_key)
+        if message is None:
+            # check if conf exists given websafeConferenceKey
+            conf_key = ndb.Key(urlsafe=websafe_key).get()
+            if not conf_key:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % websafe_key)
+            message = "No featured speakers."
+
+        etag = makeEtag(message)
+        if request.ifNoneMatch == etag:
+            return StringMessage(etag=etag, notModified=True)
+        return StringMessage(data=message, etag=etag)
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(
-            ndb.AND(
-                Conference.seatsAvailable <= 5,
-                Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
-
-
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(ANNOUNCEMENT_GET_REQUEST, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        # return an existing announcement from Memcache or an empty string.
+        """Return Announcement from memcache.
+
+        The etag is a hash of the announcement; pass it back as
+        ifNoneMatch to get a notModified reply while it is unchanged.
+        """
+        # return an existing announcement from Memcache, rebuilding it
+        # from the nearly sold out set if it was evicted
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
         if announcement is None:
-            announcement = ""
-        return StringMessage(data=announcement)
+            announcement = announcementFromNearlySoldOut()
+        etag = makeEtag(announcement)
+        if request.ifNoneMatch == etag:
+            return StringMessage(etag=etag, notModified=True)
+        return StringMessage(data=announcement, etag=etag)
 
 
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+confirmation.py -- Conference Central conference creation emails,
+    queued on a pull queue and sent in batches by a cron job
+
+Creating a conference adds a small task (conference key and organizer
+email) to the confirmation-email pull queue. The cron consumer leases
+tasks in batches, loads their conferences with one get_multi, sends one
+email per organizer covering all of their new conferences, and deletes
+the tasks it handled. Tasks that fail go back to the queue when their
+lease expires, until MAX_EMAIL_RETRIES is reached.
+
+$Id$
+
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+CONFIRMATION_QUEUE = 'confirmation-email'
+LEASE_SECONDS = 60
+LEASE_BATCH_SIZE = 100
+MAX_EMAIL_RETRIES = 5
+# stop leasing new batches well before a lease taken now could expire
+RUN_SECONDS = 45
+
+
+def enqueueConfirmationEmail(c_key, email):
+    """Queue the creation email for a new conference."""
+    taskqueue.Queue(CONFIRMATION_QUEUE).add(taskqueue.Task(
+        payload=json.dumps({'conf_key': c_key.urlsafe(), 'email': email}),
+        method='PULL'))
+
+
+def _describe(conf):
+    """Plain text summary of a conference for the email body."""
+    lines = [conf.name]
+    if conf.startDate:
+        dates = str(conf.startDate)
+        if conf.endDate and conf.endDate != conf.startDate:
+            dates += ' to %s' % conf.endDate
+        lines.append('  Dates: %s' % dates)
+    if conf.city:
+        lines.append('  City: %s' % conf.city)
+    if conf.topics:
+        lines.append('  Topics: %s' % ', '.join(conf.topics))
+    if conf.maxAttendees:
+        lines.append('  Seats: %d' % conf.maxAttendees)
+    if conf.description:
+        lines.append('  %s' % conf.description)
+    return '\n'.join(lines)
+
+
+def _sendConfirmation(email, confs, send_mail):
+    if len(confs) == 1:
+        subject = 'You created a new Conference!'
+        intro = 'Hi, you have created the following conference:'
+    else:
+        subject = 'You created %d new Conferences!' % len(confs)
+        intro = 'Hi, you have created the following conferences:'
+    send_mail(
+        'noreply@%s.appspotmail.com' % app_identity.get_application_id(),
+        email, subject,
+        '%s\r\n\r\n%s' % (intro, '\r\n\r\n'.join(_describe(conf)
+                                                 for conf in confs)))
+
+
+def _decode(task):
+    """Return (email, conference key) for a task, or None if unreadable."""
+    try:
+        payload = json.loads(task.payload)
+        return payload['email'], ndb.Key(urlsafe=payload['conf_key'])
+    except Exception:
+        logging.exception('dropping malformed confirmation task %s',
+                          task.name)
+        return None
+
+
+def processBatch(queue, tasks, stats, send_mail=mail.send_mail):
+    """Send the emails for one batch of leased tasks.
+
+    Handled tasks are deleted; failed ones are left to be leased again
+    once their lease expires, unless they have run out of retries.
+    Returns the tasks left for a retry.
+    """
+    done, retry, recipients = [], [], OrderedDict()
+    decoded = [(task, _decode(task)) for task in tasks]
+    for task, item in decoded:
+        if item is None:
+            stats['dropped'] += 1
+            done.append(task)
+    decoded = [(task, item) for task, item in decoded if item]
+    confs = ndb.get_multi([c_key for _, (_, c_key) in decoded])
+    for (task, (email, _)), conf in zip(decoded, confs):
+        if conf is None:
+            # deleted before we got to it; nothing left to confirm
+            stats['dropped'] += 1
+            done.append(task)
+        else:
+            recipients.setdefault(email, []).append((task, conf))
+
+    for email, items in recipients.items():
+        try:
+            _sendConfirmation(email, [conf for _, conf in items],
+                              send_mail)
+        except Exception:
+            logging.exception('confirmation email to %s failed', email)
+            for task, _ in items:
+                if task.retry_count >= MAX_EMAIL_RETRIES:
+                    logging.error('giving up on confirmation task %s',
+                                  task.name)
+                    stats['dropped'] += 1
+                    done.append(task)
+                else:
+                    stats['failed'] += 1
+                    retry.append(task)
+        else:
+            stats['sent'] += 1
+            stats['conferences'] += len(items)
+            done.extend(task for task, _ in items)
+
+    if done:
+        queue.delete_tasks(done)
+    return retry
+
+
+def sendConfirmationEmails(run_seconds=RUN_SECONDS,
+                           send_mail=mail.send_mail):
+    """Drain the confirmation queue in leased batches; return counters.
+
+    send_mail is called like mail.send_mail, which it defaults to.
+    """
+    queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+    stats = {'batches': 0, 'sent': 0, 'conferences': 0, 'failed': 0,
+             'dropped': 0}
+    deadline = time.time() + run_seconds
+    while time.time() < deadline:
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH_SIZE)
+        if not tasks:
+            break
+        stats['batches'] += 1
+        processBatch(queue, tasks, stats, send_mail)
+    return stats
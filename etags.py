@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""
+etags.py -- Conference Central entity tags for conditional reads
+
+Every conference has a version token in memcache, replaced whenever the
+conference, its sessions or its seats change. A read endpoint derives
+its ETag from the token before touching the datastore, so a client
+sending a matching ifNoneMatch gets a not-modified reply for the cost
+of one memcache get. Writers bump the token after their write commits;
+a token lost from memcache is simply replaced, which only costs clients
+one full reply.
+
+Payloads that already live in memcache (announcement, featured speaker)
+are tagged with a hash of their content instead.
+
+$Id$
+
+"""
+
+import hashlib
+import uuid
+
+from google.appengine.api import memcache
+
+MEMCACHE_CONFERENCE_VERSION_KEY = "CONFERENCE_VERSION %s"
+
+
+def _newVersion():
+    return uuid.uuid4().hex[:12]
+
+
+def conferenceVersion(c_key):
+    """Return a conference's current version token."""
+    memcache_key = MEMCACHE_CONFERENCE_VERSION_KEY % c_key.urlsafe()
+    version = memcache.get(memcache_key)
+    if version is None:
+        version = _newVersion()
+        if not memcache.add(memcache_key, version):
+            # another request just set one; use it
+            version = memcache.get(memcache_key) or version
+    return version
+
+
+def bumpConferenceVersion(*c_keys):
+    """Invalidate the ETags of conferences; call after the write commits."""
+    memcache.set_multi(dict((c_key.urlsafe(), _newVersion())
+                            for c_key in c_keys),
+                       key_prefix=MEMCACHE_CONFERENCE_VERSION_KEY % '')
+
+
+def makeEtag(*parts):
+    """Return a short ETag for parts (version tokens, masks, content)."""
+    digest = hashlib.md5()
+    for part in parts:
+        digest.update((u'%s\0' % (part or '')).encode('utf-8'))
+    return digest.hexdigest()[:16]
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""
+facets.py -- Conference Central per-city, per-topic and per-month
+    conference counts, maintained incrementally from conference writes
+
+$Id$
+
+"""
+
+import json
+from collections import defaultdict
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import AppliedFacetDelta
+from models import Conference
+from models import ConferenceFacetsForm
+from models import FacetCount
+from models import FacetCountForm
+from settings import FILTER_ARCHIVED
+
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+
+FACET_CITY = 'city'
+FACET_TOPIC = 'topic'
+FACET_MONTH = 'month'
+
+# cross-group transactions span at most 25 entity groups; one of them is
+# taken by the AppliedFacetDelta marker
+MAX_COUNTS_PER_TRANSACTION = 24
+
+# a retried task must still find its markers, so they outlive its retries
+FACET_TASK_AGE_LIMIT = timedelta(days=1)
+MARKER_RETENTION = timedelta(days=7)
+
+
+def conferenceFacets(conf):
+    """Return the set of (facet, value) pairs a Conference counts towards.
+
+    Archived conferences count towards none.
+    """
+    facets = set()
+    if conf.archived:
+        return facets
+    if conf.city:
+        facets.add((FACET_CITY, conf.city))
+    for topic in conf.topics or []:
+        facets.add((FACET_TOPIC, topic))
+    if conf.month:
+        facets.add((FACET_MONTH, str(conf.month)))
+    return facets
+
+
+def enqueueFacetUpdate(old_facets, new_facets):
+    """Schedule the count changes needed to move from old to new facets.
+
+    Pass an empty set as old_facets for a new conference. When called
+    inside a datastore transaction the task is enqueued transactionally.
+    """
+    delta = [[facet, value, -1] for facet, value in old_facets - new_facets]
+    delta += [[facet, value, 1] for facet, value in new_facets - old_facets]
+    if delta:
+        taskqueue.add(payload=json.dumps(delta),
+                      url='/tasks/update_facets',
+                      retry_options=taskqueue.TaskRetryOptions(
+                          task_age_limit=int(
+                              FACET_TASK_AGE_LIMIT.total_seconds())),
+                      transactional=ndb.in_transaction())
+
+
+def _countKey(facet, value):
+    return ndb.Key(FacetCount, '%s:%s' % (facet, value))
+
+
+@ndb.transactional(xg=True)
+def _applyChunk(marker_key, chunk):
+    """Apply one chunk of a delta, at most once per marker key."""
+    if marker_key.get() is not None:
+        return
+    counts = ndb.get_multi([_countKey(f, v) for f, v, _ in chunk])
+    to_put, to_delete = [AppliedFacetDelta(key=marker_key)], []
+    for (facet, value, change), count in zip(chunk, counts):
+        if count is None:
+            count = FacetCount(key=_countKey(facet, value),
+                               facet=facet, value=value)
+        count.count += change
+        if count.count > 0:
+            to_put.append(count)
+        else:
+            to_delete.append(count.key)
+    ndb.put_multi(to_put)
+    ndb.delete_multi(to_delete)
+
+
+def applyFacetDelta(task_name, payload):
+    """Apply a delta enqueued by enqueueFacetUpdate.
+
+    The task name keys a marker written in the same transaction as the
+    counts, so a retried task does not count the same change twice.
+    """
+    delta = json.loads(payload)
+    for i in range(0, len(delta), MAX_COUNTS_PER_TRANSACTION):
+        marker_key = ndb.Key(AppliedFacetDelta, '%s:%d' % (task_name, i))
+        _applyChunk(marker_key, delta[i:i + MAX_COUNTS_PER_TRANSACTION])
+    memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+def purgeFacetMarkers(batch_size=500):
+    """Delete markers older than MARKER_RETENTION; return count."""
+    cutoff = datetime.utcnow() - MARKER_RETENTION
+    purged, batch = 0, []
+    for key in AppliedFacetDelta.query(
+            AppliedFacetDelta.applied < cutoff).iter(keys_only=True):
+        batch.append(key)
+        if len(batch) == batch_size:
+            ndb.delete_multi(batch)
+            purged, batch = purged + len(batch), []
+    if batch:
+        ndb.delete_multi(batch)
+        purged += len(batch)
+    return purged
+
+
+def rebuildFacetCounts():
+    """Recount every facet from scratch; used to seed or repair counts."""
+    totals = defaultdict(int)
+    query = Conference.query()
+    if FILTER_ARCHIVED:
+        query = query.filter(Conference.archived == False)
+    # archived conferences have no facets, so unfiltered counts agree
+    for conf in query:
+        for facet in conferenceFacets(conf):
+            totals[facet] += 1
+    stale = [count.key for count in FacetCount.query()
+             if (count.facet, count.value) not in totals]
+    ndb.put_multi([FacetCount(key=_countKey(facet, value), facet=facet,
+                              value=value, count=total)
+                   for (facet, value), total in totals.items()])
+    ndb.delete_multi(stale)
+    memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+def getFacetCounts():
+    """Return a ConferenceFacetsForm, served from memcache when possible."""
+    counts = memcache.get(MEMCACHE_FACETS_KEY)
+    if counts is None:
+        counts = sorted((c.facet, c.value, c.count)
+                        for c in FacetCount.query())
+        memcache.set(MEMCACHE_FACETS_KEY, counts)
+
+    forms = {FACET_CITY: [], FACET_TOPIC: [], FACET_MONTH: []}
+    for facet, value, count in counts:
+        forms[facet].append(FacetCountForm(value=value, count=count))
+    forms[FACET_MONTH].sort(key=lambda form: int(form.value))
+    return ConferenceFacetsForm(cities=forms[FACET_CITY],
+                                topics=forms[FACET_TOPIC],
+                                months=forms[FACET_MONTH])
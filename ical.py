@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+ical.py -- Conference Central iCalendar (.ics) feeds of a conference's
+    agenda and of a user's wish-list
+
+Feeds are rendered once and kept in memcache until a write changes them
+(session creation, conference update, wish-list addition; see the
+invalidate functions), so a calendar client polling a feed costs one
+memcache get. FEED_TTL bounds how long a feed can miss a change that
+does not invalidate it, e.g. a renamed conference in wish-list feeds.
+
+Conference agendas are public, like getConferenceSessions. Wish-list
+feeds are personal but must be fetchable by calendar clients that can't
+sign in, so their URL carries a random token stored on the Profile
+(feedToken). It says nothing about the user, and rotating it revokes
+the old URL.
+
+$Id$
+
+"""
+
+import binascii
+import os
+import re
+from datetime import datetime
+from datetime import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from serializers import speakerNames
+
+MEMCACHE_CONFERENCE_FEED_KEY = "ICAL_CONFERENCE %s"
+MEMCACHE_WISHLIST_FEED_KEY = "ICAL_WISHLIST %s"
+FEED_TTL = 6 * 60 * 60
+LINE_OCTETS = 75
+FEED_TOKEN_BYTES = 16
+_FEED_TOKEN = re.compile(r'^[0-9a-f]{%d}$' % (2 * FEED_TOKEN_BYTES))
+
+# - - - Feed URLs - - - - - - - - - - - - - - - - - - - - - -
+
+
+def conferenceFeedPath(c_key):
+    return '/ical/conference/%s.ics' % c_key.urlsafe()
+
+
+def newFeedToken():
+    """Return a new random wish-list feed token."""
+    return binascii.hexlify(os.urandom(FEED_TOKEN_BYTES)).decode('ascii')
+
+
+def wishlistFeedPath(token):
+    """Return the secret feed path of a wish-list feed token."""
+    return '/ical/wishlist/%s.ics' % token
+
+# - - - Rendering - - - - - - - - - - - - - - - - - - - - - -
+
+
+def _text(value):
+    """Escape a TEXT property value (RFC 5545 section 3.3.11)."""
+    return (value or u'').replace('\\', '\\\\').replace(';', '\\;') \
+        .replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Fold a content line into lines of at most LINE_OCTETS octets."""
+    data = line.encode('utf-8')
+    lines = []
+    while len(data) > LINE_OCTETS:
+        cut = LINE_OCTETS if not lines else LINE_OCTETS - 1
+        # don't split a UTF-8 sequence: back off continuation bytes
+        while ord(data[cut:cut + 1]) & 0xC0 == 0x80:
+            cut -= 1
+        lines.append(data[:cut])
+        data = b' ' + data[cut:]
+    lines.append(data)
+    return b'\r\n'.join(lines)
+
+
+def _event(session, conf, names, stamp):
+    lines = [
+        u'BEGIN:VEVENT',
+        u'UID:%s@conference-central' % session.key.urlsafe(),
+        u'DTSTAMP:%s' % (session.modified or stamp).strftime(
+            '%Y%m%dT%H%M%SZ'),
+    ]
+    if session.startTime is not None:
+        # no time zone is stored, so times are floating (local) times
+        lines.append(u'DTSTART:%s' % datetime.combine(
+            session.date, session.startTime).strftime('%Y%m%dT%H%M%S'))
+        if session.duration:
+            lines.append(u'DURATION:PT%dH%dM' % (session.duration.hour,
+                                                 session.duration.minute))
+    else:
+        lines.append(u'DTSTART;VALUE=DATE:%s' %
+                     session.date.strftime('%Y%m%d'))
+    lines.append(u'SUMMARY:%s' % _text(session.name))
+    description = []
+    speakers = [names[k] for k in session.speakers if k in names]
+    if speakers:
+        description.append(u'Speakers: %s' % u', '.join(speakers))
+    if session.highlights:
+        description.append(u'Highlights: %s' %
+                           u', '.join(session.highlights))
+    if conf is not None:
+        description.append(conf.name)
+    if description:
+        lines.append(u'DESCRIPTION:%s' % _text(u'\n'.join(description)))
+    if conf is not None and conf.city:
+        lines.append(u'LOCATION:%s' % _text(conf.city))
+    lines.append(u'END:VEVENT')
+    return lines
+
+
+def renderCalendar(name, sessions, conferences):
+    """Render sessions as an iCalendar document.
+
+    Parameters:
+        name: calendar name shown by clients
+        sessions: Sessions; those without a date are left out
+        conferences: {conference key: Conference} of the sessions
+    """
+    sessions = [s for s in sessions if s and s.date]
+    sessions.sort(key=lambda s: (s.date, s.startTime or time.min, s.name))
+    names = speakerNames(sessions)
+    stamp = datetime.utcnow()
+    lines = [u'BEGIN:VCALENDAR', u'VERSION:2.0',
+             u'PRODID:-//Conference Central//Agenda//EN',
+             u'CALSCALE:GREGORIAN', u'X-WR-CALNAME:%s' % _text(name)]
+    for session in sessions:
+        lines.extend(_event(session, conferences.get(session.key.parent()),
+                            names, stamp))
+    lines.append(u'END:VCALENDAR')
+    return b'\r\n'.join(_fold(line) for line in lines) + b'\r\n'
+
+# - - - Feeds - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def conferenceFeed(websafe_key):
+    """Return a conference's agenda feed, or None if there's no such
+    conference."""
+    try:
+        c_key = ndb.Key(urlsafe=websafe_key)
+    except Exception:
+        return None
+    # cache under the canonical encoding, which invalidation uses
+    memcache_key = MEMCACHE_CONFERENCE_FEED_KEY % c_key.urlsafe()
+    feed = memcache.get(memcache_key)
+    if feed is not None:
+        return feed
+    conf = c_key.get() if c_key.kind() == Conference._get_kind() else None
+    if conf is None:
+        return None
+    sessions = Session.query(ancestor=c_key).fetch()
+    feed = renderCalendar(conf.name, sessions, {c_key: conf})
+    memcache.set(memcache_key, feed, time=FEED_TTL)
+    return feed
+
+
+def wishlistFeed(token):
+    """Return the wish-list feed of a feed token, or None if no profile
+    has that token.
+
+    The profile is found with an eventually consistent query, so a new
+    or rotated token may take a moment to work, and the profile's
+    current token is checked against the one asked for.
+    """
+    if not _FEED_TOKEN.match(token):
+        return None
+    memcache_key = MEMCACHE_WISHLIST_FEED_KEY % token
+    feed = memcache.get(memcache_key)
+    if feed is not None:
+        return feed
+    prof = Profile.query(Profile.feedToken == token).get()
+    if prof is None or prof.feedToken != token:
+        return None
+    sessions = ndb.get_multi(prof.wishListSessionKeys)
+    c_keys = list(set(s.key.parent() for s in sessions if s))
+    conferences = dict((conf.key, conf)
+                       for conf in ndb.get_multi(c_keys) if conf)
+    feed = renderCalendar(u'%s: wish-list' % (prof.displayName or u'My'),
+                          sessions, conferences)
+    memcache.set(memcache_key, feed, time=FEED_TTL)
+    return feed
+
+
+def invalidateConferenceFeed(c_key):
+    """Drop a conference's cached feed; call after its sessions change."""
+    memcache.delete(MEMCACHE_CONFERENCE_FEED_KEY % c_key.urlsafe())
+
+
+def invalidateWishlistFeed(token):
+    """Drop the cached wish-list feed of a feed token; call after the
+    wish-list changes or the token is rotated."""
+    if token:
+        memcache.delete(MEMCACHE_WISHLIST_FEED_KEY % token)
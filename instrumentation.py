@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- Conference Central per-request RPC counts, wall
+    time and response size, logged and aggregated per endpoint
+
+RPCs are counted with an API proxy pre-call hook, so datastore (NDB or
+not), memcache and task queue calls are all seen. Each instrumented call
+emits one structured log line and buffers a sample in the instance; the
+buffer is appended to per-endpoint rolling windows in memcache at most
+every STATS_FLUSH_SECONDS, so a request normally pays no memcache call
+for its stats. endpointStats() computes percentiles from the windows.
+
+Response sizes are taken from what was actually sent: the body of a
+webapp2 response, or the length of the JSON ProtoRPC encoded for an
+endpoint, caught by wrapping the endpoints protocol's encode_message.
+
+A request can also be run under cProfile: on demand by an admin (X-Profile
+header, or profile=1 for main.py handlers), or for a PROFILE_SAMPLE_RATE
+fraction of all traffic. The top cumulative functions and the RPC timeline
+are kept in memcache for recentProfiles()/getProfile().
+
+$Id$
+
+"""
+
+import cProfile
+import functools
+import json
+import logging
+import math
+import pstats
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import users
+
+from settings import PROFILE_SAMPLE_RATE
+from settings import PROFILER_ADMIN_EMAILS
+
+MEMCACHE_STATS_KEY = "RPC_STATS %s"
+MEMCACHE_STATS_ENDPOINTS_KEY = "RPC_STATS_ENDPOINTS"
+STATS_WINDOW = 500
+STATS_FLUSH_SECONDS = 10
+CAS_RETRIES = 3
+
+PROFILE_HEADER = 'X-Profile'
+MEMCACHE_PROFILE_KEY = "PROFILE %s"
+MEMCACHE_PROFILES_KEY = "PROFILES"
+PROFILE_TOP_FUNCTIONS = 40
+PROFILES_KEPT = 50
+PROFILE_TTL = 24 * 60 * 60
+
+# summary buckets for "service.call" names
+RPC_CATEGORIES = {
+    'datastore_v3.Get': 'gets',
+    'datastore_v3.RunQuery': 'queries',
+    'datastore_v3.Put': 'puts',
+    'taskqueue.Add': 'tasks',
+    'taskqueue.BulkAdd': 'tasks',
+}
+
+# layout of a stored sample
+SAMPLE_FIELDS = ('wallMs', 'gets', 'queries', 'puts', 'memcache', 'tasks',
+                 'responseBytes')
+
+_local = threading.local()
+
+# samples not yet flushed to memcache, {endpoint: [sample]}, and the
+# endpoints this instance knows are listed under the endpoints key
+_buffer = {}
+_bufferLock = threading.Lock()
+_lastFlush = [time.time()]
+_listedEndpoints = set()
+
+
+def _countRpc(service, call, request, response, rpc=None):
+    """API proxy pre-call hook: count the RPC if a request is recorded."""
+    calls = getattr(_local, 'calls', None)
+    if calls is not None:
+        calls.append(('%s.%s' % (service, call), time.time()))
+
+
+def _installHook():
+    """Install the RPC hook; a no-op if this API proxy already has it."""
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'instrumentation', _countRpc)
+
+
+def startRecording():
+    """Start collecting the RPCs made by the current thread."""
+    _installHook()
+    _local.calls = []
+
+
+def stopRecording():
+    """Stop collecting RPCs; return the [(name, timestamp)] collected."""
+    calls, _local.calls = getattr(_local, 'calls', None) or [], None
+    return calls
+
+
+def isRecording():
+    """True while the current thread's RPCs are being collected."""
+    return getattr(_local, 'calls', None) is not None
+
+
+def summarize(calls):
+    """Return ({'service.call': count}, {category: count}) for RPCs."""
+    counts, summary = {}, dict.fromkeys(('gets', 'queries', 'puts',
+                                         'memcache', 'tasks'), 0)
+    for name, _ in calls:
+        counts[name] = counts.get(name, 0) + 1
+        category = RPC_CATEGORIES.get(name)
+        if category is None and name.startswith('memcache.'):
+            category = 'memcache'
+        if category:
+            summary[category] += 1
+    return counts, summary
+
+
+def _installEncodeHook():
+    """Wrap the endpoints JSON encoder to pass each encoded response's
+    length to the sample waiting for it; a no-op once installed."""
+    from endpoints import protojson
+    protocol = protojson.EndpointsProtoJson
+    if getattr(protocol.encode_message, 'instrumented', False):
+        return
+
+    encode = protocol.encode_message
+
+    def encode_message(self, message):
+        encoded = encode(self, message)
+        _finishPending(len(encoded))
+        return encoded
+    encode_message.instrumented = True
+    protocol.encode_message = encode_message
+
+
+def _finishPending(size):
+    """Complete the sample of the last endpoint call with its size."""
+    finish = getattr(_local, 'pending', None)
+    if finish is not None:
+        _local.pending = None
+        finish(size)
+
+
+def _appendSamples(client, endpoint, new_samples):
+    key = MEMCACHE_STATS_KEY % endpoint
+    for _ in range(CAS_RETRIES):
+        samples = client.gets(key)
+        if samples is None:
+            if client.add(key, new_samples[-STATS_WINDOW:]):
+                return
+            continue
+        samples.extend(new_samples)
+        del samples[:-STATS_WINDOW]
+        if client.cas(key, samples):
+            return
+
+
+def _listEndpoints(client, endpoints):
+    for _ in range(CAS_RETRIES):
+        names = client.gets(MEMCACHE_STATS_ENDPOINTS_KEY)
+        if names is None:
+            if client.add(MEMCACHE_STATS_ENDPOINTS_KEY, sorted(endpoints)):
+                break
+            continue
+        missing = sorted(endpoints - set(names))
+        if not missing or client.cas(MEMCACHE_STATS_ENDPOINTS_KEY,
+                                     names + missing):
+            break
+    _listedEndpoints.update(endpoints)
+
+
+def flushSamples():
+    """Append the instance's buffered samples to the memcache windows."""
+    with _bufferLock:
+        pending = dict(_buffer)
+        _buffer.clear()
+        _lastFlush[0] = time.time()
+    if not pending:
+        return
+    client = memcache.Client()
+    for endpoint, samples in pending.items():
+        _appendSamples(client, endpoint, samples)
+    unlisted = set(pending) - _listedEndpoints
+    if unlisted:
+        _listEndpoints(client, unlisted)
+
+
+def recordSample(endpoint, sample):
+    """Buffer a sample, flushing the buffer if it is due."""
+    with _bufferLock:
+        _buffer.setdefault(endpoint, []).append(sample)
+        due = time.time() - _lastFlush[0] >= STATS_FLUSH_SECONDS
+    if due:
+        flushSamples()
+
+
+def _finishSample(endpoint, wall_ms, calls, failed, size):
+    """Log a call's stats and record its sample."""
+    try:
+        counts, summary = summarize(calls)
+        logging.info('rpcstats %s', json.dumps({
+            'endpoint': endpoint, 'wallMs': round(wall_ms, 1),
+            'responseBytes': size, 'failed': failed,
+            'rpcs': counts}, sort_keys=True))
+        recordSample(endpoint, (
+            round(wall_ms, 1), summary['gets'], summary['queries'],
+            summary['puts'], summary['memcache'], summary['tasks'], size))
+    except Exception:
+        # instrumentation must never fail the request
+        logging.exception('Could not record stats for %s', endpoint)
+
+
+def _isEndpointsAdmin():
+    """True if the authenticated endpoints user may request profiling."""
+    import endpoints
+    user = endpoints.get_current_user()
+    return user is not None and user.email() in PROFILER_ADMIN_EMAILS
+
+
+def _shouldProfile(handler):
+    """Decide whether to run this request under the profiler."""
+    request_state = getattr(handler, 'request_state', None)
+    if request_state is not None:
+        # ProtoRPC service (ConferenceApi): header only
+        if request_state.headers.get(PROFILE_HEADER):
+            return _isEndpointsAdmin()
+    else:
+        # webapp2 handler: header or ?profile=1
+        request = getattr(handler, 'request', None)
+        if request is not None and (request.headers.get(PROFILE_HEADER) or
+                                    request.GET.get('profile')):
+            return users.is_current_user_admin()
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def storeProfile(endpoint, profiler, calls, start, wall_ms):
+    """Keep the top cumulative functions and the RPC timeline in memcache.
+
+    Returns the id of the stored profile.
+    """
+    stats = pstats.Stats(profiler).stats
+    top = sorted(stats.items(), key=lambda item: item[1][3],
+                 reverse=True)[:PROFILE_TOP_FUNCTIONS]
+    profile_id = '%d-%s' % (start * 1000, endpoint)
+    record = {
+        'id': profile_id,
+        'endpoint': endpoint,
+        'started': start,
+        'wallMs': round(wall_ms, 1),
+        'functions': [{
+            'function': '%s:%d(%s)' % func,
+            'calls': calls_count,
+            'totalMs': round(total * 1000, 3),
+            'cumulativeMs': round(cumulative * 1000, 3),
+        } for func, (_, calls_count, total, cumulative, _) in top],
+        'rpcs': [{'call': name, 'offsetMs': round((at - start) * 1000, 1)}
+                 for name, at in calls],
+    }
+    client = memcache.Client()
+    client.set(MEMCACHE_PROFILE_KEY % profile_id, record, time=PROFILE_TTL)
+    for _ in range(CAS_RETRIES):
+        ids = client.gets(MEMCACHE_PROFILES_KEY)
+        if ids is None:
+            if client.add(MEMCACHE_PROFILES_KEY, [profile_id]):
+                break
+            continue
+        if client.cas(MEMCACHE_PROFILES_KEY,
+                      ([profile_id] + ids)[:PROFILES_KEPT]):
+            break
+    logging.info('profiled %s as %s', endpoint, profile_id)
+    return profile_id
+
+
+def recentProfiles():
+    """Return [(id, endpoint, wallMs)] of the stored profiles, newest first."""
+    ids = memcache.get(MEMCACHE_PROFILES_KEY) or []
+    records = memcache.get_multi(ids, key_prefix=MEMCACHE_PROFILE_KEY % '')
+    return [(i, records[i]['endpoint'], records[i]['wallMs'])
+            for i in ids if i in records]
+
+
+def getProfile(profile_id):
+    """Return a stored profile record, or None if it expired."""
+    return memcache.get(MEMCACHE_PROFILE_KEY % profile_id)
+
+
+def instrumented(func):
+    """Decorator recording RPC counts, wall time & response size of a call.
+
+    Apply it to ConferenceApi endpoint methods (below @endpoints.method)
+    and to webapp2 handler methods. Selected requests are also profiled.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if isRecording():
+            return func(self, *args, **kwargs)
+        # a previous call whose response was never encoded
+        _finishPending(0)
+        endpoint = '%s.%s' % (type(self).__name__, func.__name__)
+        try:
+            profiler = cProfile.Profile() if _shouldProfile(self) else None
+        except Exception:
+            logging.exception('Could not decide on profiling %s', endpoint)
+            profiler = None
+        result, failed = None, True
+        start = time.time()
+        startRecording()
+        try:
+            if profiler is not None:
+                result = profiler.runcall(func, self, *args, **kwargs)
+            else:
+                result = func(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            calls = stopRecording()
+            wall_ms = (time.time() - start) * 1000.0
+            try:
+                if profiler is not None:
+                    storeProfile(endpoint, profiler, calls, start, wall_ms)
+            except Exception:
+                logging.exception('Could not store profile of %s', endpoint)
+            finish = functools.partial(_finishSample, endpoint, wall_ms,
+                                       calls, failed)
+            response = getattr(self, 'response', None)
+            if not failed and hasattr(result, 'all_fields'):
+                # an endpoint: its size is known once ProtoRPC encodes it
+                try:
+                    _installEncodeHook()
+                    _local.pending = finish
+                except Exception:
+                    logging.exception('Could not hook response encoding')
+                    finish(0)
+            elif not failed and hasattr(response, 'body'):
+                finish(len(response.body))
+            else:
+                finish(0)
+    return wrapper
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = int(math.ceil(fraction * len(ordered))) - 1
+    return ordered[max(rank, 0)]
+
+
+def endpointStats():
+    """Return {endpoint: {field: {p50, p95, p99}, 'samples': n}}.
+
+    Other instances' samples show up once they flush.
+    """
+    flushSamples()
+    names = memcache.get(MEMCACHE_STATS_ENDPOINTS_KEY) or []
+    windows = memcache.get_multi(names, key_prefix=MEMCACHE_STATS_KEY % '')
+    stats = {}
+    for endpoint, samples in sorted(windows.items()):
+        if not samples:
+            continue
+        stats[endpoint] = {'samples': len(samples)}
+        for i, field in enumerate(SAMPLE_FIELDS):
+            ordered = sorted(sample[i] for sample in samples)
+            stats[endpoint][field] = dict(
+                (label, _percentile(ordered, fraction))
+                for label, fraction in (('p50', 0.50), ('p95', 0.95),
+                                        ('p99', 0.99)))
+    return stats
@@ -4,6 +4,11 @@
 main.py -- Udacity conference server-side Python App Engine
     HTTP controller handlers for memcache & task queue access
 
+Handlers import what they need when they run: this app serves cron and
+task queue requests, and must not pay for loading endpoints and the
+ConferenceApi (conference.py) on every cold start. See
+benchmarks/bench_startup.py.
+
 $Id$
 
 created by wesc on 2014 may 24
@@ -12,21 +17,42 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+import logging
+
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from conference import ConferenceApi
+
+from instrumentation import instrumented
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
+    @instrumented
     def get(self):
         """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        from worker import cacheAnnouncement
+        cacheAnnouncement()
+
+
+class UpdateAnnouncementHandler(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Update the nearly sold out set after a seat change."""
+        from worker import updateAnnouncement
+        updateAnnouncement(self.request.get('conf_key'),
+                           rebuild=self.request.get('rebuild') == '1')
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
+    @instrumented
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation.
+
+        Conference creation now uses the confirmation-email pull queue
+        (SendConfirmationEmailsHandler); this drains tasks added before
+        the switch.
+        """
+        from google.appengine.api import app_identity
+        from google.appengine.api import mail
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -38,18 +64,227 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Send queued conference creation emails in batches."""
+        from confirmation import sendConfirmationEmails
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(sendConfirmationEmails(),
+                                       sort_keys=True))
+
+
+class PurgeFacetMarkersHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Delete facet delta markers past their retention period."""
+        from facets import purgeFacetMarkers
+        self.response.write('Purged %d facet markers.' % purgeFacetMarkers())
+
+
+class BuildRecommendationsHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Recompute the similar sessions behind recommendations."""
+        from recommendations import buildRecommendations
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(buildRecommendations(),
+                                       sort_keys=True))
+
+
+class ArchiveConferencesHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Start archiving finished conferences, from the daily cron."""
+        self._archiveBatch()
+
+    @instrumented
+    def post(self):
+        """Continue archiving, from the task chained by the last batch."""
+        self._archiveBatch()
+
+    def _archiveBatch(self):
+        """Archive one batch and chain a task for the next one."""
+        from google.appengine.api import taskqueue
+        from archive import archiveFinishedConferences
+        archived, more = archiveFinishedConferences()
+        if more:
+            taskqueue.add(url='/crons/archive_conferences')
+        self.response.write('Archived %d conferences.' % archived)
+
+
 class FeaturedSpeaker(webapp2.RequestHandler):
+    @instrumented
     def post(self):
         '''Find the speaker with most sessions in a conference
 
         That is the so-called featured speaker
         '''
-        ConferenceApi._cacheFeaturedSpeaker(self.request.get('conf_key'))
+        from worker import cacheFeaturedSpeaker
+        cacheFeaturedSpeaker(self.request.get('conf_key'))
+
+
+class IndexDocumentHandler(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """(Re)index a Conference or Session in the search index."""
+        from searchindex import indexEntity
+        indexEntity(self.request.get('websafe_key'))
+
+
+class SearchBackfillHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Start indexing every existing Conference and Session."""
+        from google.appengine.api import taskqueue
+        for kind in ('Conference', 'Session'):
+            taskqueue.add(params={'kind': kind},
+                          url='/tasks/search_backfill')
+        self.response.write('Search index backfill started.')
+
+    @instrumented
+    def post(self):
+        """Index one batch and chain a task for the next one."""
+        from google.appengine.api import taskqueue
+        from searchindex import backfillIndex
+        kind = self.request.get('kind')
+        next_cursor = backfillIndex(kind, self.request.get('cursor'))
+        if next_cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': next_cursor},
+                          url='/tasks/search_backfill')
+
+
+class MigrateSchemaHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Start rewriting Conferences, Sessions & Profiles."""
+        from google.appengine.api import taskqueue
+        for kind in ('Conference', 'Session', 'Profile'):
+            taskqueue.add(params={'kind': kind},
+                          url='/tasks/migrate_schema')
+        self.response.write('Schema migration started.')
+
+    @instrumented
+    def post(self):
+        """Rewrite one batch and chain a task for the next one."""
+        from google.appengine.api import taskqueue
+        from migration import migrateBatch
+        kind = self.request.get('kind')
+        next_cursor = migrateBatch(kind, self.request.get('cursor'))
+        if next_cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': next_cursor},
+                          url='/tasks/migrate_schema')
+        else:
+            logging.info('Schema migration of %s entities finished', kind)
+
+
+class UpdateFacetsHandler(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Apply a conference facet count delta."""
+        from facets import applyFacetDelta
+        applyFacetDelta(self.request.headers['X-AppEngine-TaskName'],
+                        self.request.body)
+
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self):
+        """Recount conference facets from scratch."""
+        from facets import rebuildFacetCounts
+        rebuildFacetCounts()
+        self.response.write('Conference facets rebuilt.')
+
+
+class BuildScheduleHandler(webapp2.RequestHandler):
+    @instrumented
+    def post(self):
+        """Rematerialize a conference's agenda grid."""
+        from google.appengine.ext import ndb
+        from schedule import buildSchedule
+        buildSchedule(ndb.Key(urlsafe=self.request.get('conf_key')))
 
 
+def _writeCalendar(response, feed, cache_control):
+    response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+    response.headers['Cache-Control'] = cache_control
+    response.write(feed)
+
+
+class ConferenceFeedHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self, websafe_key):
+        """Serve a conference's agenda as an iCalendar feed."""
+        from ical import conferenceFeed
+        feed = conferenceFeed(websafe_key)
+        if feed is None:
+            self.abort(404)
+        _writeCalendar(self.response, feed, 'public, max-age=300')
+
+
+class WishlistFeedHandler(webapp2.RequestHandler):
+    @instrumented
+    def get(self, token):
+        """Serve a user's wish-list as an iCalendar feed."""
+        from ical import wishlistFeed
+        feed = wishlistFeed(token)
+        if feed is None:
+            self.abort(404)
+        _writeCalendar(self.response, feed, 'private, max-age=300')
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Import the API and prime caches before serving users."""
+        from warmup import warmUp
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(warmUp(), sort_keys=True))
+
+
+class StatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show rolling per-endpoint latency, RPC & size percentiles."""
+        from instrumentation import endpointStats
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(endpointStats(), indent=2,
+                                       sort_keys=True))
+
+
+class ProfilesHandler(webapp2.RequestHandler):
+    def get(self):
+        """List recent request profiles, or show the one given by ?id=."""
+        from instrumentation import getProfile
+        from instrumentation import recentProfiles
+        profile_id = self.request.get('id')
+        if profile_id:
+            result = getProfile(profile_id)
+            if result is None:
+                self.abort(404)
+        else:
+            result = [{'id': i, 'endpoint': endpoint, 'wallMs': wall_ms}
+                      for i, endpoint, wall_ms in recentProfiles()]
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(result, indent=2, sort_keys=True))
+
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/purge_facet_markers', PurgeFacetMarkersHandler),
+    ('/crons/archive_conferences', ArchiveConferencesHandler),
+    ('/crons/build_recommendations', BuildRecommendationsHandler),
+    ('/tasks/update_announcement', UpdateAnnouncementHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/featured_speaker', FeaturedSpeaker),
+    ('/tasks/index_document', IndexDocumentHandler),
+    ('/tasks/search_backfill', SearchBackfillHandler),
+    ('/tasks/migrate_schema', MigrateSchemaHandler),
+    ('/tasks/update_facets', UpdateFacetsHandler),
+    ('/tasks/rebuild_facets', RebuildFacetsHandler),
+    ('/tasks/build_schedule', BuildScheduleHandler),
+    (r'/ical/conference/([^/]+)\.ics', ConferenceFeedHandler),
+    (r'/ical/wishlist/([^/]+)\.ics', WishlistFeedHandler),
+    ('/_ah/warmup', WarmupHandler),
+    ('/admin/stats', StatsHandler),
+    ('/admin/profiles', ProfilesHandler),
 ], debug=True)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+migration.py -- Conference Central batched rewrite of Conference, Session
+    and Profile entities into the current schema
+
+Session times and types and Profile t-shirt sizes and membership lists
+now store minutes, enum numbers and keys (see the properties at the top
+of models.py). Those properties read the old formats too, so loading an
+entity and putting it back converts it. Until every entity has been
+rewritten, equality and range filters on the converted properties
+(e.g. getConferenceSessionsByType, queryProblem) miss old entities.
+
+Batches are read keys-only, and each entity is re-read and put in its
+own transaction, so registrations, wish-list additions and seat changes
+made meanwhile are not overwritten. Entities already in the current
+format are left alone.
+
+Conferences and Sessions written before the archive flag existed have
+no archived property, so the archived == False filters (see archive.py)
+would miss them until they are rewritten with its default. Those filters
+are only applied once settings.FILTER_ARCHIVED is set, which should wait
+until this migration has finished.
+
+$Id$
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+
+MIGRATION_BATCH_SIZE = 200
+
+_MODELS = dict((model._get_kind(), model) for model in (Conference, Session, Profile))
+
+
+def _needsRewrite(entity):
+    if getattr(entity, '_legacyEncoding', False):
+        return True
+    # stored before the archived property existed
+    return isinstance(entity, (Conference, Session)) and \
+        not type(entity).archived._has_value(entity)
+
+
+@ndb.transactional()
+def _migrateEntity(key):
+    """Re-put one entity if it is in an old format; True if it was."""
+    entity = key.get()
+    if entity is None or not _needsRewrite(entity):
+        return False
+    entity.put()
+    return True
+
+
+def migrateBatch(kind, websafe_cursor=None):
+    """Rewrite one batch of a kind; return the cursor of the next batch.
+
+    Returns None once every entity of the kind has been rewritten.
+    """
+    model = _MODELS[kind]
+    cursor = ndb.Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+    keys, next_cursor, more = model.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    for key in keys:
+        _migrateEntity(key)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
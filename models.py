@@ -12,29 +12,162 @@ created/forked from conferences.py by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
-import httplib
-import endpoints
+from datetime import time
+
 from protorpc import messages
+from google.appengine.api import datastore_errors
+from google.appengine.datastore import entity_pb
 from google.appengine.ext import ndb
 
 
-class StringMessage(messages.Message):
-    """StringMessage-- outbound (single) string message"""
-    data = messages.StringField(1, required=True)
+class TeeShirtSize(messages.Enum):
+    """TeeShirtSize -- t-shirt size enumeration value"""
+    NOT_SPECIFIED = 1
+    XS_M = 2
+    XS_W = 3
+    S_M = 4
+    S_W = 5
+    M_M = 6
+    M_W = 7
+    L_M = 8
+    L_W = 9
+    XL_M = 10
+    XL_W = 11
+    XXL_M = 12
+    XXL_W = 13
+    XXXL_M = 14
+    XXXL_W = 15
+
+
+class SessionType(messages.Enum):
+    """ SessionType -- session type enumeration value."""
+    NOT_SPECIFIED = 1
+    Lecture = 2
+    Keynote = 3
+    Workshop = 4
+    QuestionsAndAnswers = 5
+    Information = 6
+
 
+# - - - compact property encodings - - - - - - - - - - - - - - - - - -
+#
+# Session and Profile used to store times as TimeProperty values, enums
+# as their names and membership lists as websafe key strings. These
+# properties store minutes, enum numbers and datastore keys instead, and
+# also decode the old formats when reading, so old entities load fine
+# and convert when rewritten (see migration.py).
 
-class ConflictException(endpoints.ServiceException):
-    """ConflictException -- exception mapped to HTTP 409 response"""
-    http_status = httplib.CONFLICT
+MINUTES_PER_DAY = 24 * 60
+
+
+class _LegacyEncoding(object):
+    """Mixin flagging entities read with an old encoding of a property
+    (entity._legacyEncoding), so the migration only rewrites those."""
+
+    def _isLegacy(self, p):
+        raise NotImplementedError
+
+    def _deserialize(self, entity, p, *args, **kwds):
+        if self._isLegacy(p):
+            entity._legacyEncoding = True
+        return super(_LegacyEncoding, self)._deserialize(
+            entity, p, *args, **kwds)
+
+
+class MinutesProperty(_LegacyEncoding, ndb.IntegerProperty):
+    """A datetime.time, stored as whole minutes since midnight."""
+
+    def _validate(self, value):
+        if not isinstance(value, time):
+            raise datastore_errors.BadValueError(
+                'Expected datetime.time, got %r' % (value,))
+
+    def _to_base_type(self, value):
+        return value.hour * 60 + value.minute
+
+    def _from_base_type(self, value):
+        return time(*divmod(value, 60))
+
+    def _isLegacy(self, p):
+        return p.meaning() == entity_pb.Property.GD_WHEN
+
+    def _db_get_value(self, v, p):
+        value = super(MinutesProperty, self)._db_get_value(v, p)
+        # an old TimeProperty value: microseconds since 1970-01-01 00:00,
+        # so at least a minute's worth unless it was midnight
+        if value is not None and value >= MINUTES_PER_DAY:
+            value //= 60 * 1000000
+        return value
+
+
+class EnumCodeProperty(_LegacyEncoding, ndb.IntegerProperty):
+    """The name of a protorpc enum value, stored as its number."""
+
+    def __init__(self, enum_class, *args, **kwds):
+        super(EnumCodeProperty, self).__init__(*args, **kwds)
+        self._enum_class = enum_class
+
+    def _validate(self, value):
+        try:
+            self._enum_class(value)
+        except TypeError:
+            raise datastore_errors.BadValueError(
+                '%r is not a %s' % (value, self._enum_class.__name__))
+
+    def _to_base_type(self, value):
+        return self._enum_class(value).number
+
+    def _from_base_type(self, value):
+        try:
+            return self._enum_class(value).name
+        except TypeError:
+            return None
+
+    def _isLegacy(self, p):
+        return p.value().has_stringvalue()
+
+    def _db_get_value(self, v, p):
+        if v.has_stringvalue():
+            # an old value, stored by name
+            try:
+                return self._enum_class(v.stringvalue()).number
+            except TypeError:
+                return None
+        return super(EnumCodeProperty, self)._db_get_value(v, p)
+
+
+class WebsafeCompatibleKeyProperty(_LegacyEncoding, ndb.KeyProperty):
+    """A KeyProperty that also reads websafe key strings."""
+
+    def _isLegacy(self, p):
+        return p.value().has_stringvalue()
+
+    def _db_get_value(self, v, p):
+        if v.has_stringvalue():
+            return ndb.Key(urlsafe=v.stringvalue())
+        return super(WebsafeCompatibleKeyProperty, self)._db_get_value(v, p)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class StringMessage(messages.Message):
+    """StringMessage-- outbound (single) string message"""
+    data = messages.StringField(1)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
 
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
-    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    wishListSessionKeys = ndb.StringProperty(repeated=True)
+    teeShirtSize = EnumCodeProperty(TeeShirtSize, default='NOT_SPECIFIED')
+    conferenceKeysToAttend = WebsafeCompatibleKeyProperty(kind='Conference',
+                                                          repeated=True)
+    wishListSessionKeys = WebsafeCompatibleKeyProperty(kind='Session',
+                                                       repeated=True)
+    wishListIntervals = ndb.JsonProperty()
+    feedToken = ndb.StringProperty()
 
 
 class ProfileMiniForm(messages.Message):
@@ -52,6 +185,17 @@ class ProfileForm(messages.Message):
     wishListSessionKeys = messages.StringField(5, repeated=True)
 
 
+class WishlistConflictForm(messages.Message):
+    """WishlistConflictForm -- wish-list session and the ones it overlaps"""
+    websafeSessionKey = messages.StringField(1)
+    conflictsWith = messages.StringField(2, repeated=True)
+
+
+class WishlistConflictForms(messages.Message):
+    """WishlistConflictForms -- all overlapping sessions in a wish-list"""
+    items = messages.MessageField(WishlistConflictForm, 1, repeated=True)
+
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
@@ -64,6 +208,14 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    modified        = ndb.DateTimeProperty(auto_now=True)
+    archived        = ndb.BooleanProperty(default=False)
+
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- singleton set of conferences with few seats left"""
+    conferenceKeys = ndb.KeyProperty(kind=Conference, repeated=True,
+                                     indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -80,6 +232,8 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 
 class Speaker(ndb.Model):
@@ -102,10 +256,12 @@ class Session(ndb.Model):
     name = ndb.StringProperty(required=True)
     highlights = ndb.StringProperty(repeated=True)
     speakers = ndb.KeyProperty(kind=Speaker, repeated=True)
-    duration = ndb.TimeProperty()
-    typeOfSession = ndb.StringProperty(default='NOT_SPECIFIED')
+    duration = MinutesProperty()
+    typeOfSession = EnumCodeProperty(SessionType, default='NOT_SPECIFIED')
     date = ndb.DateProperty()
-    startTime = ndb.TimeProperty()
+    startTime = MinutesProperty()
+    modified = ndb.DateTimeProperty(auto_now=True)
+    archived = ndb.BooleanProperty(default=False)
 
 
 class SessionForm(messages.Message):
@@ -124,6 +280,51 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Conference Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
+    notFound = messages.StringField(4, repeated=True)
+
+
+class ConferenceSchedule(ndb.Model):
+    """ConferenceSchedule -- day/time-slot grid of a conference's sessions,
+    stored as one compressed JSON blob (child of its Conference)"""
+    grid = ndb.BlobProperty(compressed=True)
+    sessionCount = ndb.IntegerProperty(indexed=False)
+
+
+class SessionRecommendation(ndb.Model):
+    """SessionRecommendation -- sessions most like a session, best first,
+    with their similarity scores (child of its Session)"""
+    sessionKeys = ndb.KeyProperty(kind=Session, repeated=True, indexed=False)
+    scores = ndb.FloatProperty(repeated=True, indexed=False)
+
+
+class ScheduleSessionForm(messages.Message):
+    """ScheduleSessionForm -- one session within a schedule time slot"""
+    websafeKey = messages.StringField(1)
+    name = messages.StringField(2)
+    typeOfSession = messages.EnumField('SessionType', 3)
+    duration = messages.StringField(4)
+    speakers = messages.StringField(5, repeated=True)
+    highlights = messages.StringField(6, repeated=True)
+
+
+class ScheduleSlotForm(messages.Message):
+    """ScheduleSlotForm -- sessions sharing a start time"""
+    startTime = messages.StringField(1)
+    sessions = messages.MessageField(ScheduleSessionForm, 2, repeated=True)
+
+
+class ScheduleDayForm(messages.Message):
+    """ScheduleDayForm -- time slots of one conference day"""
+    date = messages.StringField(1)
+    slots = messages.MessageField(ScheduleSlotForm, 2, repeated=True)
+
+
+class ConferenceScheduleForm(messages.Message):
+    """ConferenceScheduleForm -- outbound day/time-slot conference agenda"""
+    websafeConferenceKey = messages.StringField(1)
+    days = messages.MessageField(ScheduleDayForm, 2, repeated=True)
 
 
 class BooleanMessage(messages.Message):
@@ -134,35 +335,66 @@ class BooleanMessage(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    notFound = messages.StringField(2, repeated=True)
 
 
-class TeeShirtSize(messages.Enum):
-    """TeeShirtSize -- t-shirt size enumeration value"""
-    NOT_SPECIFIED = 1
-    XS_M = 2
-    XS_W = 3
-    S_M = 4
-    S_W = 5
-    M_M = 6
-    M_W = 7
-    L_M = 8
-    L_W = 9
-    XL_M = 10
-    XL_W = 11
-    XXL_M = 12
-    XXL_W = 13
-    XXXL_M = 14
-    XXXL_W = 15
+class ConferenceDetailForm(messages.Message):
+    """ConferenceDetailForm -- a Conference with the viewer's status,
+    its featured speaker and its number of sessions"""
+    conference = messages.MessageField(ConferenceForm, 1)
+    sessionCount = messages.IntegerField(2)
+    featuredSpeaker = messages.StringField(3)
+    isAttending = messages.BooleanField(4)
+    wishListSessionKeys = messages.StringField(5, repeated=True)
 
 
-class SessionType(messages.Enum):
-    """ SessionType -- session type enumeration value."""
-    NOT_SPECIFIED = 1
-    Lecture = 2
-    Keynote = 3
-    Workshop = 4
-    QuestionsAndAnswers = 5
-    Information = 6
+class ConferenceSearchForms(messages.Message):
+    """ConferenceSearchForms -- ranked page of Conference search results"""
+    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    numberFound = messages.IntegerField(3)
+
+
+class SessionSearchForms(messages.Message):
+    """SessionSearchForms -- ranked page of Session search results"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    numberFound = messages.IntegerField(3)
+
+
+class FacetCount(ndb.Model):
+    """FacetCount -- number of conferences sharing a city/topic/month value"""
+    facet = ndb.StringProperty()
+    value = ndb.StringProperty()
+    count = ndb.IntegerProperty(default=0)
+
+
+class AppliedFacetDelta(ndb.Model):
+    """AppliedFacetDelta -- marker making facet count updates idempotent"""
+    applied = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ChangesForm(messages.Message):
+    """ChangesForm -- outbound page of conferences and sessions changed
+    since a watermark"""
+    conferences = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions = messages.MessageField(SessionForm, 2, repeated=True)
+    cursor = messages.StringField(4)
+    watermark = messages.StringField(5)
+
+
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- outbound count of conferences for one facet value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- outbound conference counts per facet value"""
+    cities = messages.MessageField(FacetCountForm, 1, repeated=True)
+    topics = messages.MessageField(FacetCountForm, 2, repeated=True)
+    months = messages.MessageField(FacetCountForm, 3, repeated=True)
+
 
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
@@ -171,6 +403,11 @@ class ConferenceQueryForm(messages.Message):
     value = messages.StringField(3)
 
 
+class WebsafeKeysForm(messages.Message):
+    """WebsafeKeysForm -- inbound list of websafe entity keys"""
+    websafeKeys = messages.StringField(1, repeated=True)
+
+
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
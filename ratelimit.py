@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+ratelimit.py -- Conference Central per-user token bucket rate limits on
+    ConferenceApi write methods
+
+Each (budget, user) pair has a bucket in memcache holding some tokens
+and the time they were counted. A call refills the bucket for the time
+elapsed, takes a token, and is rejected with HTTP 429 if there was none
+-- before the method runs, so a throttled call costs two memcache RPCs and no datastore
+work. Budgets are configured in settings.RATE_LIMITS.
+
+Memcache is only a cache: an evicted bucket comes back full, and if the
+bucket can't be updated (memcache down, or contention beyond
+CAS_RETRIES) the call is let through.
+
+$Id$
+
+"""
+
+import functools
+import logging
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from settings import RATE_LIMITS
+from utils import getUserId
+
+MEMCACHE_RATE_LIMIT_KEY = "RATE_LIMIT %s %s"
+CAS_RETRIES = 3
+
+
+class RateLimitException(endpoints.ServiceException):
+    """RateLimitException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
+
+def takeToken(budget, user_id, now=None):
+    """Take a token from a user's bucket.
+
+    Returns 0 if the call may go ahead, else the seconds until a token
+    is available.
+    """
+    capacity, per_minute = RATE_LIMITS[budget]
+    rate = per_minute / 60.0
+    now = now or time.time()
+    key = MEMCACHE_RATE_LIMIT_KEY % (budget, user_id)
+    # an untouched bucket refills completely by then, so it may expire
+    ttl = int(capacity / rate) + 1
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        bucket = client.gets(key)
+        if bucket is None:
+            if client.add(key, (capacity - 1, now), time=ttl):
+                return 0
+            continue
+        tokens, counted = bucket
+        tokens = min(capacity, tokens + (now - counted) * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate
+        if client.cas(key, (tokens - 1, now), time=ttl):
+            return 0
+    logging.warning('rate limit bucket %s not updated; allowing call', key)
+    return 0
+
+
+def rateLimited(budget):
+    """Decorator applying a RATE_LIMITS budget to a ConferenceApi method.
+
+    Apply it below @instrumented, so rejected calls are recorded too.
+    Unauthenticated calls are not limited here; the method rejects them.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            user = endpoints.get_current_user()
+            if user is not None:
+                wait = takeToken(budget, getUserId(user))
+                if wait:
+                    raise RateLimitException(
+                        'Rate limit exceeded; retry in %d seconds.' %
+                        max(1, round(wait)))
+            return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
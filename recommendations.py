@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""
+recommendations.py -- Conference Central "you might also like" session
+    recommendations, precomputed from wish-lists and registrations
+
+Two sessions are alike when the same people wish for them: their score
+is the cosine similarity of their columns in the profile x session
+wish-list matrix, i.e. co-occurrences / sqrt(product of popularities).
+Registrations add REGISTRATION_WEIGHT times the cosine similarity of
+the sessions' conferences in the profile x conference registration
+matrix (1 for the same conference), so sessions of conferences the same
+people attend rank higher.
+
+A daily cron job computes both co-occurrence matrices with numpy from
+coordinate lists (scipy.sparse is not available on App Engine), and
+stores the TOP_K most similar sessions of every session as a
+SessionRecommendation child entity. Serving a wish-list's
+recommendations then costs one batch get.
+
+$Id$
+
+"""
+
+from collections import defaultdict
+
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import SessionRecommendation
+
+TOP_K = 20
+REGISTRATION_WEIGHT = 0.5
+DEFAULT_RECOMMENDATIONS = 10
+
+# a profile with n list entries adds n * (n - 1) pairs; bigger lists are
+# skipped rather than let one account dominate the job's memory & time
+MAX_BASKET_SIZE = 200
+PUT_BATCH_SIZE = 500
+
+
+def recommendationKey(s_key):
+    """Return the SessionRecommendation key of a session key."""
+    return ndb.Key(SessionRecommendation, 'similar', parent=s_key)
+
+
+def recommendSessions(wished_keys, limit=DEFAULT_RECOMMENDATIONS):
+    """Return up to limit session keys for a wish-list, best first.
+
+    The scores of a session recommended for several wished sessions add
+    up; sessions already on the wish-list are left out.
+    """
+    totals = defaultdict(float)
+    for rec in ndb.get_multi([recommendationKey(k) for k in wished_keys]):
+        if rec:
+            for s_key, score in zip(rec.sessionKeys, rec.scores):
+                totals[s_key] += score
+    for s_key in wished_keys:
+        totals.pop(s_key, None)
+    ranked = sorted(totals.items(), key=lambda item: -item[1])
+    return [s_key for s_key, _ in ranked[:limit]]
+
+# - - - Batch job - - - - - - - - - - - - - - - - - - - - - -
+#
+# numpy is imported inside the functions: it is only loaded by the cron
+# job, not by the API instances importing this module for the above.
+
+
+def _memberships(name):
+    """Return (profile numbers, keys) of a Profile key list property.
+
+    A projection query on a repeated property returns one result per
+    list element, so this reads the (profile, key) coordinate list of
+    the membership matrix straight from the index.
+    """
+    profiles, keys, numbers = [], [], {}
+    for prof in Profile.query().iter(
+            projection=[getattr(Profile, name)], batch_size=1000):
+        profiles.append(numbers.setdefault(prof.key, len(numbers)))
+        keys.append(getattr(prof, name)[0])
+    return profiles, keys
+
+
+def _runs(values):
+    """Return start indices and lengths of the runs of a sorted array."""
+    import numpy
+    if not len(values):
+        return numpy.zeros(0, numpy.int64), numpy.zeros(0, numpy.int64)
+    starts = numpy.flatnonzero(numpy.r_[True, values[1:] != values[:-1]])
+    return starts, numpy.diff(numpy.r_[starts, len(values)])
+
+
+def _cooccurrence(rows, cols, size):
+    """Co-occurrences of the columns of a sparse 0/1 matrix.
+
+    The matrix A has ones at (rows, cols) and size columns. Returns
+    arrays (i, j, count) of the nonzero off-diagonal entries of A.T * A,
+    sorted by i * size + j, and the column sums of A.
+    """
+    import numpy
+    codes = numpy.unique(numpy.asarray(rows, numpy.int64) * size +
+                         numpy.asarray(cols, numpy.int64))
+    if not len(codes):
+        empty = numpy.zeros(0, numpy.int64)
+        return empty, empty, empty, numpy.zeros(size, numpy.int64)
+    rows, cols = codes // size, codes % size
+
+    starts, sizes = _runs(rows)
+    keep = numpy.repeat(sizes <= MAX_BASKET_SIZE, sizes)
+    rows, cols = rows[keep], cols[keep]
+    totals = numpy.bincount(cols, minlength=size)
+
+    # pair every entry with every entry of its row: entry e of a row
+    # starting at s with n entries is paired with entries s .. s + n - 1
+    starts, sizes = _runs(rows)
+    row_sizes = numpy.repeat(sizes, sizes)
+    row_starts = numpy.repeat(starts, sizes)
+    left = numpy.repeat(numpy.arange(len(rows)), row_sizes)
+    first = numpy.cumsum(row_sizes) - row_sizes
+    right = numpy.repeat(row_starts, row_sizes) + \
+        numpy.arange(len(left)) - numpy.repeat(first, row_sizes)
+    distinct = left != right
+
+    codes = numpy.sort(cols[left[distinct]] * size + cols[right[distinct]])
+    starts, counts = _runs(codes)
+    codes = codes[starts]
+    return codes // size, codes % size, counts, totals
+
+
+def _cosine(i, j, counts, totals):
+    import numpy
+    return counts / numpy.sqrt((totals[i] * totals[j]).astype(numpy.float64))
+
+
+def buildRecommendations(top_k=TOP_K):
+    """Recompute & store the recommendations of every wished session.
+
+    Recommendations of sessions nobody wishes for any more are deleted.
+    Returns counts for the cron handler's response.
+    """
+    import numpy
+
+    wish_profiles, wished = _memberships('wishListSessionKeys')
+    reg_profiles, registered = _memberships('conferenceKeysToAttend')
+
+    s_numbers, c_numbers = {}, {}
+    s_cols = [s_numbers.setdefault(k, len(s_numbers)) for k in wished]
+    c_cols = [c_numbers.setdefault(k, len(c_numbers)) for k in registered]
+    s_keys = sorted(s_numbers, key=s_numbers.get)
+    # a session's conference is its parent; those nobody registered for
+    # get numbers too, and simply co-occur with nothing
+    s_confs = numpy.array([c_numbers.setdefault(k.parent(), len(c_numbers))
+                           for k in s_keys], numpy.int64)
+    n_sessions, n_confs = len(s_numbers), len(c_numbers)
+
+    i, j, counts, totals = _cooccurrence(wish_profiles, s_cols, n_sessions)
+    scores = _cosine(i, j, counts, totals)
+
+    ci, cj, c_counts, c_totals = _cooccurrence(reg_profiles, c_cols, n_confs)
+    c_codes = ci * n_confs + cj
+    a, b = s_confs[i], s_confs[j]
+    conf_scores = numpy.where(a == b, 1.0, 0.0)
+    if len(c_codes):
+        wanted = a * n_confs + b
+        found = numpy.minimum(numpy.searchsorted(c_codes, wanted),
+                              len(c_codes) - 1)
+        hit = c_codes[found] == wanted
+        conf_scores[hit] = _cosine(ci, cj, c_counts, c_totals)[found[hit]]
+    scores += REGISTRATION_WEIGHT * conf_scores
+
+    # best top_k per session
+    order = numpy.lexsort((-scores, i))
+    i, j, scores = i[order], j[order], scores[order]
+    starts, lengths = _runs(i)
+    top = numpy.arange(len(i)) - numpy.repeat(starts, lengths) < top_k
+    i, j, scores = i[top], j[top], scores[top]
+
+    entities = []
+    for start, length in zip(*_runs(i)):
+        end = start + length
+        entities.append(SessionRecommendation(
+            key=recommendationKey(s_keys[int(i[start])]),
+            sessionKeys=[s_keys[int(t)] for t in j[start:end]],
+            scores=[round(float(score), 4) for score in scores[start:end]]))
+    for start in range(0, len(entities), PUT_BATCH_SIZE):
+        ndb.put_multi(entities[start:start + PUT_BATCH_SIZE])
+
+    fresh = set(entity.key for entity in entities)
+    stale = [key for key in SessionRecommendation.query().iter(
+             keys_only=True) if key not in fresh]
+    ndb.delete_multi(stale)
+    return {'wishListEntries': len(wished),
+            'registrations': len(registered),
+            'sessionPairs': int(len(counts)),
+            'stored': len(entities),
+            'deleted': len(stale)}
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+schedule.py -- Conference Central per-conference agenda, materialized
+    as a day/time-slot grid whenever the conference's sessions change
+
+$Id$
+
+"""
+
+import json
+from datetime import date
+from datetime import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import ConferenceSchedule
+from models import ConferenceScheduleForm
+from models import ScheduleDayForm
+from models import ScheduleSessionForm
+from models import ScheduleSlotForm
+from models import Session
+from models import SessionType
+
+
+def scheduleKey(c_key):
+    """Return the ConferenceSchedule key of a conference key."""
+    return ndb.Key(ConferenceSchedule, 'schedule', parent=c_key)
+
+
+def enqueueScheduleBuild(c_key):
+    """Schedule a rebuild of a conference's agenda grid."""
+    taskqueue.add(params={'conf_key': c_key.urlsafe()},
+                  url='/tasks/build_schedule',
+                  transactional=ndb.in_transaction())
+
+
+def buildSchedule(c_key):
+    """Materialize the agenda grid of a conference and store it.
+
+    Sessions are grouped by date, then by start time; speakers are
+    resolved with a single get_multi. Returns the stored ConferenceSchedule.
+    """
+    sessions = Session.query(ancestor=c_key).fetch()
+    sessions.sort(key=lambda s: (s.date or date.min, s.startTime or time.min,
+                                 s.name))
+
+    speaker_keys = list(set(k for s in sessions for k in s.speakers))
+    names = dict((speaker.key, speaker.name)
+                 for speaker in ndb.get_multi(speaker_keys) if speaker)
+
+    days = []
+    for session in sessions:
+        day, start = str(session.date), str(session.startTime)
+        if not days or days[-1]['date'] != day:
+            days.append({'date': day, 'slots': []})
+        slots = days[-1]['slots']
+        if not slots or slots[-1]['startTime'] != start:
+            slots.append({'startTime': start, 'sessions': []})
+        slots[-1]['sessions'].append({
+            'websafeKey': session.key.urlsafe(),
+            'name': session.name,
+            'typeOfSession': session.typeOfSession,
+            'duration': str(session.duration),
+            'speakers': [names[k] for k in session.speakers if k in names],
+            'highlights': session.highlights,
+        })
+
+    schedule = ConferenceSchedule(
+        key=scheduleKey(c_key),
+        grid=json.dumps(days, separators=(',', ':')),
+        sessionCount=len(sessions))
+    schedule.put()
+    return schedule
+
+
+def copyScheduleToForm(c_key, schedule):
+    """Copy a stored ConferenceSchedule grid to a ConferenceScheduleForm."""
+    days = []
+    for day in json.loads(schedule.grid):
+        slots = []
+        for slot in day['slots']:
+            slots.append(ScheduleSlotForm(
+                startTime=slot['startTime'],
+                sessions=[ScheduleSessionForm(
+                    websafeKey=s['websafeKey'],
+                    name=s['name'],
+                    typeOfSession=getattr(SessionType, s['typeOfSession']),
+                    duration=s['duration'],
+                    speakers=s['speakers'],
+                    highlights=s['highlights'],
+                ) for s in slot['sessions']]))
+        days.append(ScheduleDayForm(date=day['date'], slots=slots))
+    return ConferenceScheduleForm(websafeConferenceKey=c_key.urlsafe(),
+                                  days=days)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+searchindex.py -- Conference Central full-text search over conferences
+    and sessions, built on the App Engine Search API
+
+$Id$
+
+"""
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# search.Index.put() accepts at most 200 documents per call
+BACKFILL_BATCH_SIZE = 200
+
+
+def _conferenceDocument(conf):
+    """Build the search Document for a Conference."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description or ''),
+        search.TextField(name='topics', value=' '.join(conf.topics or [])),
+        search.AtomField(name='city', value=conf.city or ''),
+    ]
+    if conf.startDate:
+        fields.append(search.DateField(name='startDate', value=conf.startDate))
+    return search.Document(doc_id=conf.key.urlsafe(), fields=fields)
+
+
+def _sessionDocument(session, speakerNames):
+    """Build the search Document for a Session."""
+    fields = [
+        search.TextField(name='name', value=session.name),
+        search.TextField(name='highlights',
+                         value=' '.join(session.highlights or [])),
+        search.TextField(name='speakers', value=' '.join(speakerNames)),
+        search.AtomField(name='typeOfSession',
+                         value=session.typeOfSession or ''),
+        search.AtomField(name='websafeConferenceKey',
+                         value=session.key.parent().urlsafe()),
+    ]
+    if session.date:
+        fields.append(search.DateField(name='date', value=session.date))
+    return search.Document(doc_id=session.key.urlsafe(), fields=fields)
+
+
+def _sessionDocuments(sessions):
+    """Build Documents for sessions, fetching all speakers in one batch."""
+    speaker_keys = list(set(k for s in sessions for k in s.speakers))
+    names = dict((speaker.key, speaker.name)
+                 for speaker in ndb.get_multi(speaker_keys) if speaker)
+    return [_sessionDocument(s, [names[k] for k in s.speakers if k in names])
+            for s in sessions]
+
+
+def enqueueIndexing(key):
+    """Schedule (re)indexing of a Conference or Session key.
+
+    When called inside a datastore transaction the task is enqueued
+    transactionally, so the index is only touched once the write commits.
+    """
+    taskqueue.add(params={'websafe_key': key.urlsafe()},
+                  url='/tasks/index_document',
+                  transactional=ndb.in_transaction())
+
+
+def indexEntity(websafe_key):
+    """Index the entity behind websafe_key, or drop it if it is gone."""
+    key = ndb.Key(urlsafe=websafe_key)
+    index_name = (CONFERENCE_INDEX if key.kind() == Conference._get_kind()
+                  else SESSION_INDEX)
+    entity = key.get()
+    if entity is None:
+        search.Index(name=index_name).delete(websafe_key)
+    elif index_name == CONFERENCE_INDEX:
+        search.Index(name=index_name).put(_conferenceDocument(entity))
+    else:
+        search.Index(name=index_name).put(_sessionDocuments([entity]))
+
+
+def backfillIndex(kind, websafe_cursor=None):
+    """Index one batch of a kind; return the cursor of the next batch.
+
+    Returns None once every entity of the kind has been indexed.
+    """
+    if kind == Conference._get_kind():
+        model, index_name = Conference, CONFERENCE_INDEX
+    else:
+        model, index_name = Session, SESSION_INDEX
+    cursor = ndb.Cursor(urlsafe=websafe_cursor) if websafe_cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        BACKFILL_BATCH_SIZE, start_cursor=cursor)
+    if entities:
+        if model is Conference:
+            docs = [_conferenceDocument(conf) for conf in entities]
+        else:
+            docs = _sessionDocuments(entities)
+        search.Index(name=index_name).put(docs)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
+
+
+def _queryIndex(index_name, query_string, limit, websafe_cursor):
+    """Run a ranked, paged query against an index.
+
+    Returns a (keys, next cursor, number found) tuple. Raises
+    search.QueryError if the query string cannot be parsed.
+    """
+    limit = min(limit or DEFAULT_LIMIT, MAX_LIMIT)
+    sort_options = search.SortOptions(
+        match_scorer=search.MatchScorer(),
+        expressions=[search.SortExpression(
+            expression='_score',
+            direction=search.SortExpression.DESCENDING,
+            default_value=0.0)])
+    options = search.QueryOptions(
+        limit=limit,
+        cursor=search.Cursor(web_safe_string=websafe_cursor or None),
+        sort_options=sort_options,
+        ids_only=True)
+    results = search.Index(name=index_name).search(
+        search.Query(query_string=query_string, options=options))
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    next_cursor = results.cursor.web_safe_string if results.cursor else None
+    return keys, next_cursor, results.number_found
+
+
+def queryConferenceIndex(query_string, limit=None, websafe_cursor=None):
+    """Search conferences by name, description, topics and city."""
+    return _queryIndex(CONFERENCE_INDEX, query_string, limit, websafe_cursor)
+
+
+def querySessionIndex(query_string, limit=None, websafe_cursor=None):
+    """Search sessions by name, highlights and speakers."""
+    return _queryIndex(SESSION_INDEX, query_string, limit, websafe_cursor)
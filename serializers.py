@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+"""
+serializers.py -- Conference Central entity <-> ProtoRPC form copying
+
+Each FormSerializer compiles, once at import time, the list of fields to
+copy between an ndb model and a ProtoRPC form together with their value
+converters, so copying a row is a straight loop over precomputed
+(getter, setter, converter) tuples instead of all_fields()/hasattr/getattr
+and per-field name checks.
+
+A field mask (the comma separated `fieldMask` request parameter) narrows a
+copy to some form fields; FormSerializer.projection() tells whether a
+datastore projection query, or a keys-only query for masks that read no
+properties (e.g. websafeKey), can provide what the mask needs, and
+fetchMasked() runs one, falling back to whole entities.
+
+$Id$
+
+"""
+
+import logging
+from datetime import datetime
+from operator import attrgetter
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import SessionType
+from models import TeeShirtSize
+
+_NO_DEFAULT = object()
+
+# FormSerializer.projection() result for masks served by keys alone
+KEYS_ONLY = object()
+
+
+class FormSerializer(object):
+    """Precompiled copy plan between an ndb model and a ProtoRPC form.
+
+    Parameters:
+        form_class: ProtoRPC Message class
+        model_class: ndb Model class
+        to_form: {field name: converter} applied to non-computed
+            entity values copied to the form
+        computed: {field name: function(entity, context)} for form fields
+            that are not model properties; a None result leaves the
+            field unset
+        from_form: {field name: converter} applied to truthy form values
+            copied to the entity
+        requires: {computed field name: model property names it reads}
+    """
+
+    def __init__(self, form_class, model_class, to_form=None, computed=None,
+                 from_form=None, requires=None):
+        to_form = to_form or {}
+        computed = computed or {}
+        from_form = from_form or {}
+        requires = requires or {}
+        self.form_class = form_class
+        self.model_class = model_class
+
+        fields = sorted(form_class.all_fields(), key=lambda f: f.number)
+        properties = model_class._properties
+
+        plan = []
+        for field in fields:
+            if field.name in computed:
+                plan.append((field.name, None, field.__set__,
+                             computed[field.name]))
+            elif field.name in properties:
+                plan.append((field.name, attrgetter(field.name),
+                             field.__set__, to_form.get(field.name)))
+        self.plan = tuple(plan)
+        self.field_names = frozenset(field.name for field in fields)
+        self.requires = dict(
+            (name, tuple(requires.get(name, ())) if getter is None
+             else (name,))
+            for name, getter, _, _ in plan)
+        self._masked_plans = {}
+
+        self.inverse_plan = tuple(
+            (field.name, attrgetter(field.name), field.__set__,
+             from_form.get(field.name))
+            for field in fields if field.name in properties)
+
+        self.check = any(field.required for field in fields)
+
+    def parseMask(self, fields):
+        """Parse a comma separated field mask.
+
+        Returns a frozenset of form field names, or None (all fields) if
+        fields is empty. Raises ValueError naming any unknown fields.
+        """
+        mask = frozenset(name.strip() for name in (fields or '').split(',')
+                         if name.strip())
+        unknown = mask - self.field_names
+        if unknown:
+            raise ValueError('Unknown field(s) in mask: %s'
+                             % ', '.join(sorted(unknown)))
+        return mask or None
+
+    def _planFor(self, mask):
+        if mask is None:
+            return self.plan
+        plan = self._masked_plans.get(mask)
+        if plan is None:
+            plan = tuple(step for step in self.plan if step[0] in mask)
+            self._masked_plans[mask] = plan
+        return plan
+
+    def projection(self, mask):
+        """Return the properties to project to serve a mask, KEYS_ONLY
+        if the mask needs no properties, or None.
+
+        None means a projection query can't serve the mask: no mask, or
+        a repeated or unindexed property.
+        """
+        if mask is None:
+            return None
+        names = set()
+        for name in mask:
+            names.update(self.requires.get(name, ()))
+        for name in names:
+            prop = self.model_class._properties[name]
+            if prop._repeated or not prop._indexed:
+                return None
+        return tuple(sorted(names)) or KEYS_ONLY
+
+    def toForm(self, entity, context=None, mask=None):
+        """Copy an entity, or the mask's fields of it, to a new form."""
+        form = self.form_class()
+        for name, getter, setter, convert in self._planFor(mask):
+            if getter is None:
+                value = convert(entity, context)
+                if value is None:
+                    continue
+            else:
+                value = getter(entity)
+                if convert is not None:
+                    value = convert(value)
+            setter(form, value)
+        if self.check and mask is None:
+            form.check_initialized()
+        return form
+
+    def toEntityData(self, form, defaults=None):
+        """Copy a form to a dict of entity properties.
+
+        Missing (None or empty) values are replaced by defaults, which are
+        also written back to the form so it can be returned as the
+        outbound message.
+        """
+        defaults = defaults or {}
+        data = {}
+        for name, getter, setter, convert in self.inverse_plan:
+            value = getter(form)
+            if value in (None, []):
+                default = defaults.get(name, _NO_DEFAULT)
+                if default is not _NO_DEFAULT:
+                    value = default
+                    setter(form, default)
+            if convert is not None and value:
+                value = convert(value)
+            data[name] = value
+        return data
+
+
+def _parseDate(value):
+    return datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def _parseTime(value):
+    return datetime.strptime(value[:5], "%H:%M").time()
+
+
+def _enumByName(enum_class):
+    """Return a converter from enum name string to enum value."""
+    by_name = dict((value.name, value) for value in enum_class)
+    return by_name.__getitem__
+
+
+def _websafeKeys(keys):
+    return [key.urlsafe() for key in keys]
+
+
+def _websafeKey(entity, context):
+    return entity.key.urlsafe()
+
+
+def _websafeParentKey(entity, context):
+    return entity.key.parent().urlsafe()
+
+
+def _organizerDisplayName(conf, display_name):
+    return display_name or None
+
+
+def _speakerNames(session, names):
+    return [names[key] for key in session.speakers if key in names]
+
+
+CONFERENCE_SERIALIZER = FormSerializer(
+    ConferenceForm, Conference,
+    to_form={'startDate': str, 'endDate': str},
+    computed={'websafeKey': _websafeKey,
+              'organizerDisplayName': _organizerDisplayName},
+    from_form={'startDate': _parseDate, 'endDate': _parseDate},
+    requires={'organizerDisplayName': ('organizerUserId',)},
+)
+
+SESSION_SERIALIZER = FormSerializer(
+    SessionForm, Session,
+    to_form={'date': str, 'startTime': str, 'duration': str,
+             'typeOfSession': _enumByName(SessionType)},
+    computed={'speakers': _speakerNames,
+              'websafeKey': _websafeKey,
+              'websafeConferenceKey': _websafeParentKey},
+    from_form={'date': _parseDate, 'startTime': _parseTime,
+               'duration': _parseTime, 'typeOfSession': str},
+    requires={'speakers': ('speakers',)},
+)
+
+PROFILE_SERIALIZER = FormSerializer(
+    ProfileForm, Profile,
+    to_form={'teeShirtSize': _enumByName(TeeShirtSize),
+             'conferenceKeysToAttend': _websafeKeys,
+             'wishListSessionKeys': _websafeKeys},
+)
+
+
+def speakerNames(sessions):
+    """Return {speaker key: name} for sessions, using one get_multi."""
+    keys = list(set(key for session in sessions for key in session.speakers))
+    return dict((speaker.key, speaker.name)
+                for speaker in ndb.get_multi(keys) if speaker)
+
+
+def sessionsToForms(sessions, mask=None):
+    """Copy sessions to SessionForms, resolving all speakers in one batch.
+
+    Speakers are only looked up if the mask includes them.
+    """
+    sessions = list(sessions)
+    if mask is None or 'speakers' in mask:
+        names = speakerNames(sessions)
+    else:
+        names = {}
+    return [SESSION_SERIALIZER.toForm(session, names, mask)
+            for session in sessions]
+
+
+def fetchMasked(query, serializer, mask):
+    """Fetch a query's results, as a projection query if the mask allows.
+
+    Falls back to whole entities if the datastore has no composite index
+    for the projection, or refuses it (e.g. a projected property that
+    also has an equality filter).
+    """
+    projection = serializer.projection(mask)
+    if projection is KEYS_ONLY:
+        # entities holding just their keys, for the computed key fields
+        return [serializer.model_class(key=key)
+                for key in query.fetch(keys_only=True)]
+    if projection:
+        try:
+            return query.fetch(projection=projection)
+        except (datastore_errors.NeedIndexError,
+                datastore_errors.BadRequestError) as e:
+            logging.info('projection on %s failed, fetching entities: %s',
+                         ', '.join(projection), e)
+    return query.fetch()
@@ -16,3 +16,25 @@ WEB_CLIENT_ID = '821112098496-8gqoidsvva03odn2d6ame3a2p5hljif1.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Request profiling: fraction of instrumented requests run under cProfile,
+# and the accounts allowed to ask for it with the X-Profile header.
+PROFILE_SAMPLE_RATE = 0.0
+PROFILER_ADMIN_EMAILS = []
+
+# Per-user write budgets (ratelimit.py): budget name -> (burst size,
+# calls allowed per minute after the burst).
+RATE_LIMITS = {
+    'createConference': (5, 1),
+    'updateConference': (20, 10),
+    'saveProfile': (10, 6),
+    'createSession': (20, 10),
+    'registration': (10, 6),
+    'wishlist': (30, 30),
+}
+
+# Whether the default conference and session queries leave out archived
+# entities (archive.py). Entities stored before the archived property
+# existed have no value for it and are missed by archived == False
+# filters, so only set this once /tasks/migrate_schema has finished.
+FILTER_ARCHIVED = False
@@ -17,6 +17,74 @@ var conferenceApp = conferenceApp || {};
  */
 conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstrap']);
 
+/**
+ * Invokes a read method of the conference API with conditional GET.
+ *
+ * The last successful reply and its etag are kept per method and parameters (in sessionStorage when
+ * available). The etag is sent as ifNoneMatch; when the server replies notModified, the callback gets
+ * the kept reply instead.
+ *
+ * @param method name of the conference API method, e.g. 'getConference'.
+ * @param params the request parameters.
+ * @param callback called with the response, like execute's callback.
+ * @param field optional; the reply field that carries the etag, when it is not the reply itself.
+ */
+conferenceApp.cachedCall = (function () {
+    var memory = {};
+    var storage = null;
+    try {
+        storage = window.sessionStorage;
+    } catch (e) {
+        // storage disabled; keep replies in memory only
+    }
+
+    var load = function (cacheKey) {
+        if (memory[cacheKey]) {
+            return memory[cacheKey];
+        }
+        if (storage) {
+            var stored = storage.getItem(cacheKey);
+            if (stored) {
+                memory[cacheKey] = JSON.parse(stored);
+            }
+        }
+        return memory[cacheKey];
+    };
+
+    var save = function (cacheKey, entry) {
+        memory[cacheKey] = entry;
+        if (storage) {
+            try {
+                storage.setItem(cacheKey, JSON.stringify(entry));
+            } catch (e) {
+                // quota exceeded; the in-memory copy still works
+            }
+        }
+    };
+
+    return function (method, params, callback, field) {
+        var cacheKey = 'conference.' + method + ':' + JSON.stringify(params);
+        var cached = load(cacheKey);
+        var request = angular.extend({}, params);
+        if (cached) {
+            request.ifNoneMatch = cached.etag;
+        }
+        gapi.client.conference[method](request).execute(function (resp) {
+            var part = (!resp.error && resp.result) ? (field ? resp.result[field] : resp.result) : null;
+            if (part && part.notModified && cached) {
+                if (field) {
+                    resp.result[field] = angular.copy(cached.result);
+                } else {
+                    resp = {result: angular.copy(cached.result)};
+                }
+            } else if (part && part.etag) {
+                save(cacheKey, {etag: part.etag, result: angular.copy(part)});
+            }
+            callback(resp);
+        });
+    };
+})();
+
 /**
  * @ngdoc controller
  * @name MyProfileCtrl
@@ -554,14 +622,15 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConferenceDetail method and sets the returned conference, its featured speaker,
+     * its session count and whether the user attends it in the $scope.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        conferenceApp.cachedCall('getConferenceDetail', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -574,31 +643,19 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                 } else {
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
-                }
-            });
-        });
-
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
+                    $scope.conference = resp.result.conference;
+                    $scope.featuredSpeaker = resp.result.featuredSpeaker;
+                    $scope.sessionCount = resp.result.sessionCount || 0;
+                    $scope.wishListSessionKeys = resp.result.wishListSessionKeys || [];
+                    if (resp.result.isAttending) {
+                        // The user is attending the conference.
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are attending this conference';
+                        $scope.isUserAttending = true;
                     }
                 }
             });
-        });
+        }, 'conference');
     };
 
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+sync.py -- Conference Central delta sync: conferences and sessions
+    changed after a client's watermark
+
+A sync walks two phases in order -- changed conferences, then changed
+sessions -- each a query on its timestamp, and pages across them with
+one opaque cursor. Every page
+returns the watermark the client should send next time. It is taken
+when the sync starts, minus WATERMARK_LAG, because auto_now timestamps
+are set by the writing instance before its commit and the queries are
+eventually consistent; entities near the watermark may be sent twice,
+never missed.
+
+The API has no delete methods, so there are no deletions to sync; a
+delete path would need a tombstone phase here.
+
+$Id$
+
+"""
+
+import base64
+import json
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Conference
+from models import Session
+
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+WATERMARK_LAG = timedelta(minutes=2)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+_PHASES = (
+    (Conference, Conference.modified),
+    (Session, Session.modified),
+)
+
+
+def parseWatermark(value):
+    """Parse a watermark string; raises ValueError if malformed."""
+    return datetime.strptime(value, WATERMARK_FORMAT)
+
+
+def formatWatermark(value):
+    return value.strftime(WATERMARK_FORMAT)
+
+
+def _encodeCursor(phase, since, watermark, cursor):
+    return base64.urlsafe_b64encode(json.dumps([
+        phase, since and formatWatermark(since), formatWatermark(watermark),
+        cursor.urlsafe() if cursor else None]).encode('utf-8'))
+
+
+def _decodeCursor(value):
+    """Return (phase, since, watermark, datastore cursor) from a cursor.
+
+    Raises ValueError if it is not one of ours.
+    """
+    try:
+        phase, since, watermark, cursor = json.loads(
+            base64.urlsafe_b64decode(str(value)).decode('utf-8'))
+        return (int(phase), since and parseWatermark(since),
+                parseWatermark(watermark),
+                Cursor(urlsafe=cursor) if cursor else None)
+    except Exception:
+        raise ValueError('Invalid sync cursor')
+
+
+def _phaseQuery(phase, since):
+    model, timestamp = _PHASES[phase]
+    if since is None:
+        return model.query()
+    return model.query(timestamp > since).order(timestamp)
+
+
+def changesSince(since, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return one page of changes.
+
+    Parameters:
+        since: watermark datetime, or None for a full sync
+        cursor: cursor string from the previous page, if any; when given
+            it overrides since
+        limit: maximum number of entities in the page
+
+    Returns (conferences, sessions, next cursor or None, watermark
+    datetime).
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    if cursor:
+        phase, since, watermark, start = _decodeCursor(cursor)
+    else:
+        phase, watermark, start = 0, datetime.utcnow() - WATERMARK_LAG, None
+
+    results = ([], [])
+    remaining, next_cursor = limit, None
+    while phase < len(_PHASES):
+        if not remaining:
+            next_cursor = _encodeCursor(phase, since, watermark, start)
+            break
+        entities, next_start, more = _phaseQuery(phase, since).fetch_page(
+            remaining, start_cursor=start)
+        results[phase].extend(entities)
+        remaining -= len(entities)
+        if more and next_start:
+            next_cursor = _encodeCursor(phase, since, watermark, next_start)
+            break
+        phase, start = phase + 1, None
+
+    conferences, sessions = results
+    return conferences, sessions, next_cursor, watermark
+
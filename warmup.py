@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+warmup.py -- Conference Central instance warmup: imports the API and
+    primes caches so the first user request runs at steady-state latency
+
+$Id$
+
+"""
+
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+HOT_CONFERENCES = 20
+
+
+def _timed(timings, name, func, *args):
+    """Run one warmup step, recording its duration in milliseconds."""
+    start = time.time()
+    result = func(*args)
+    timings[name] = round((time.time() - start) * 1000, 1)
+    return result
+
+
+def _importApi():
+    # endpoints, ProtoRPC, the models and the api_server configuration;
+    # importing serializers compiles the form copy plans
+    import conference
+    import serializers
+
+
+def _hotConferences():
+    """Conferences with the fewest seats left, i.e. the most in demand."""
+    from models import Conference
+    from settings import FILTER_ARCHIVED
+    query = Conference.query(Conference.seatsAvailable > 0)
+    if FILTER_ARCHIVED:
+        query = query.filter(Conference.archived == False)
+    keys = query.order(Conference.seatsAvailable).fetch(
+        HOT_CONFERENCES, keys_only=True)
+    # loading them fills NDB's memcache-backed entity cache
+    return [conf for conf in ndb.get_multi(keys) if conf]
+
+
+def _primeConferences(confs):
+    from serializers import CONFERENCE_SERIALIZER
+    for conf in confs:
+        CONFERENCE_SERIALIZER.toForm(conf, None)
+
+
+def _primeAnnouncement():
+    import worker
+    if memcache.get(worker.MEMCACHE_ANNOUNCEMENTS_KEY) is None:
+        worker.announcementFromNearlySoldOut()
+
+
+def _primeFeaturedSpeakers(confs):
+    import worker
+    cached = memcache.get_multi(
+        [conf.key.urlsafe() for conf in confs],
+        key_prefix=worker.MEMCACHE_FEATURED_SPEAKER_KEY % '')
+    for conf in confs:
+        if conf.key.urlsafe() not in cached:
+            worker.cacheFeaturedSpeaker(conf.key.urlsafe())
+
+
+def _primeSchedules(confs):
+    from schedule import scheduleKey
+    ndb.get_multi([scheduleKey(conf.key) for conf in confs])
+
+
+def _primeFacets():
+    from facets import getFacetCounts
+    getFacetCounts()
+
+
+def warmUp():
+    """Warm this instance up; return {step: milliseconds}."""
+    timings = {}
+    start = time.time()
+    _timed(timings, 'importApi', _importApi)
+    confs = _timed(timings, 'hotConferences', _hotConferences)
+    _timed(timings, 'conferenceForms', _primeConferences, confs)
+    _timed(timings, 'announcement', _primeAnnouncement)
+    _timed(timings, 'featuredSpeakers', _primeFeaturedSpeakers, confs)
+    _timed(timings, 'schedules', _primeSchedules, confs)
+    _timed(timings, 'facets', _primeFacets)
+    timings['total'] = round((time.time() - start) * 1000, 1)
+    logging.info('warmup took %.1f ms: %s', timings['total'], timings)
+    return timings
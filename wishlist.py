@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""
+wishlist.py -- Conference Central interval index of a user's wish-list,
+    used to detect overlapping sessions without reloading them
+
+$Id$
+
+"""
+
+from bisect import bisect_left
+from bisect import insort
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def sessionInterval(session):
+    """Return [start, end, websafeKey] of a session, in minutes since the
+    epoch, or None if the session has no date or start time.
+    """
+    if session.date is None or session.startTime is None:
+        return None
+    delta = datetime.combine(session.date, session.startTime) - EPOCH
+    start = delta.days * 24 * 60 + delta.seconds // 60
+    duration = session.duration
+    length = duration.hour * 60 + duration.minute if duration else 0
+    return [start, start + length, session.key.urlsafe()]
+
+
+def buildIndex(sessions):
+    """Build an index from sessions.
+
+    The index is a JSON-friendly dict holding the intervals sorted by start
+    time and the longest duration, which bounds how far back an
+    overlapping interval can start.
+    """
+    index = {'maxDuration': 0, 'intervals': []}
+    for session in sessions:
+        if session is not None:
+            addInterval(index, sessionInterval(session))
+    return index
+
+
+@ndb.non_transactional
+def _getSessions(keys):
+    """Fetch sessions outside any transaction; a wish-list can span more
+    entity groups than a cross-group transaction allows."""
+    return ndb.get_multi(keys)
+
+
+def loadIndex(prof):
+    """Return the profile's wish-list index, building it if missing."""
+    if prof.wishListIntervals is None:
+        prof.wishListIntervals = buildIndex(
+            _getSessions(prof.wishListSessionKeys))
+    return prof.wishListIntervals
+
+
+def addInterval(index, interval):
+    """Insert an interval, keeping the index sorted by start time."""
+    if interval is None:
+        return
+    insort(index['intervals'], interval)
+    index['maxDuration'] = max(index['maxDuration'],
+                               interval[1] - interval[0])
+
+
+def findConflicts(index, interval):
+    """Return websafe keys of indexed sessions overlapping an interval.
+
+    Only intervals starting between (start - maxDuration) and end can
+    overlap, so two binary searches bound the scan: O(log n + k).
+    """
+    if interval is None:
+        return []
+    start, end, websafe_key = interval
+    intervals = index['intervals']
+    lo = bisect_left(intervals, [start - index['maxDuration']])
+    hi = bisect_left(intervals, [max(end, start + 1)])
+    return [other[2] for other in intervals[lo:hi]
+            if _overlap(interval, other) and other[2] != websafe_key]
+
+
+def allConflicts(index):
+    """Return (websafeKey, [overlapping websafeKeys]) for every conflict.
+
+    A single sweep over the sorted intervals: O(n + k).
+    """
+    intervals = index['intervals']
+    conflicts = {}
+    for i, interval in enumerate(intervals):
+        for other in intervals[i + 1:]:
+            if other[0] >= max(interval[1], interval[0] + 1):
+                break
+            if _overlap(interval, other):
+                conflicts.setdefault(interval[2], []).append(other[2])
+                conflicts.setdefault(other[2], []).append(interval[2])
+    return sorted(conflicts.items())
+
+
+def _overlap(a, b):
+    """True if two intervals overlap; a zero-length session occupies the
+    minute it starts in."""
+    return (a[0] < max(b[1], b[0] + 1)) and (b[0] < max(a[1], a[0] + 1))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+worker.py -- Conference Central background work: announcement and
+    featured speaker caching
+
+Used by the cron and task queue handlers in main.py. This module must
+stay free of endpoints and ProtoRPC service imports (conference.py), so
+that task queue instances start quickly.
+
+$Id$
+
+"""
+
+from collections import Counter
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import NearlySoldOut
+from models import Session
+from settings import FILTER_ARCHIVED
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER %s"
+
+# - - - Featured Speaker  - - - - - - - - - - - - - - - - - -
+
+
+def cacheFeaturedSpeaker(websafe_key):
+    '''Update featured speaker for given conference
+
+    The fetured speaker is the speaker in most sessions in a conference.
+
+    Parameters:
+        websafe_key: websafe conference key string
+    '''
+
+    # get count of speaker appearences in conference sessions
+    c_key = ndb.Key(urlsafe=websafe_key)
+    sessions = Session.query(ancestor=c_key)
+    speaker_count = Counter([s_key
+                             for session in sessions
+                             for s_key in session.speakers]).most_common()
+
+    # Get key of most frequent speaker
+    featured_speaker = speaker_count[0][0] if speaker_count else None
+
+    # Store featured speaker in memcache
+    memcache_key = MEMCACHE_FEATURED_SPEAKER_KEY % c_key.urlsafe()
+
+    if featured_speaker is not None:
+        msg = 'FEATURED SPEAKER: %s' % featured_speaker.get().name
+        memcache.set(memcache_key, msg)
+    else:
+        memcache.delete(memcache_key)
+
+# - - - Announcements - - - - - - - - - - - - - - - - - - - -
+
+
+def isNearlySoldOut(conf):
+    """Return True if a conference belongs in the announcement."""
+    return 0 < (conf.seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS
+
+
+def enqueueAnnouncementUpdate(c_key, rebuild=False):
+    """Schedule a nearly sold out set update for one conference.
+
+    Pass rebuild=True when the announcement text may be stale even if
+    the set doesn't change, e.g. after a listed conference is renamed.
+    """
+    params = {'conf_key': c_key.urlsafe()}
+    if rebuild:
+        params['rebuild'] = '1'
+    taskqueue.add(params=params,
+                  url='/tasks/update_announcement',
+                  transactional=ndb.in_transaction())
+
+
+def setAnnouncement(names):
+    """Format the announcement for conference names & store in memcache.
+
+    An empty announcement is stored too, so that a memcache miss always
+    means the entry was evicted.
+    """
+    if names:
+        announcement = '%s %s' % (
+            'Last chance to attend! The following conferences '
+            'are nearly sold out:',
+            ', '.join(names))
+    else:
+        announcement = ""
+    memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
+
+
+def announcementFromNearlySoldOut():
+    """Rebuild the announcement from the stored nearly sold out set."""
+    nearly_sold_out = ndb.Key(NearlySoldOut, 'announcement').get()
+    keys = nearly_sold_out.conferenceKeys if nearly_sold_out else []
+    return setAnnouncement([conf.name for conf in ndb.get_multi(keys) if conf])
+
+
+@ndb.transactional()
+def _moveNearlySoldOut(c_key, nearly_sold_out):
+    """Add or remove a conference key; return True if the set changed."""
+    entity = ndb.Key(NearlySoldOut, 'announcement').get() or \
+        NearlySoldOut(id='announcement')
+    if (c_key in entity.conferenceKeys) == nearly_sold_out:
+        return False
+    if nearly_sold_out:
+        entity.conferenceKeys.append(c_key)
+    else:
+        entity.conferenceKeys.remove(c_key)
+    entity.put()
+    return True
+
+
+def updateAnnouncement(websafe_key, rebuild=False):
+    """Reflect a conference's current seats in the nearly sold out set.
+
+    The announcement is only rebuilt if the set actually changed, or if
+    rebuild is True. The conference is re-read rather than trusting the
+    task payload, so tasks may run late or out of order.
+    """
+    c_key = ndb.Key(urlsafe=websafe_key)
+    conf = c_key.get()
+    nearly_sold_out = conf is not None and not conf.archived and \
+        isNearlySoldOut(conf)
+    if _moveNearlySoldOut(c_key, nearly_sold_out) or rebuild:
+        announcementFromNearlySoldOut()
+
+
+def cacheAnnouncement():
+    """Create Announcement & assign to memcache; used by
+    memcache cron job to reconcile the nearly sold out set.
+    """
+    query = Conference.query(
+        ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0))
+    if FILTER_ARCHIVED:
+        confs = query.filter(Conference.archived == False).fetch(
+            projection=[Conference.name])
+    else:
+        # a projection on archived would skip entities without a value
+        confs = [conf for conf in query if not conf.archived]
+
+    NearlySoldOut(id='announcement',
+                  conferenceKeys=[conf.key for conf in confs]).put()
+    return setAnnouncement([conf.name for conf in confs])